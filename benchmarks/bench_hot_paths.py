@@ -0,0 +1,164 @@
+"""Micro-benchmarks of the functions on the hot path of a collection and push run.
+
+Run from the repository root with ``python -m pytest benchmarks``, see
+conftest.py for comparing runs. Every group times one page of 1000
+detection events, or one call where the function works on a single
+value, so the numbers of a group can be compared with each other.
+"""
+import json
+import logging
+import socket
+import ssl
+import pytest
+
+PROTOCOLS = ("UDP", "TCP", "TLS")
+HEADER = b"<14>2023-05-31T14:10:00Z VECTRA-SYSLOG-CONNECTOR: "
+
+
+@pytest.fixture(scope="module")
+def events(page):
+    return page["events"]
+
+
+@pytest.fixture(scope="module")
+def event_bytes(connector, events):
+    encode_event = connector("syslog_writer").encode_event
+    return [encode_event(event) for event in events]
+
+
+def legacy_formatter():
+    """Formatter the push task used with the logging handler."""
+    return logging.Formatter("2023-05-31T14:10:00Z VECTRA-SYSLOG-CONNECTOR: %(message)s\n")
+
+
+def records(events):
+    return [
+        logging.LogRecord("bench", logging.INFO, __file__, 0, json.dumps(event), None, None)
+        for event in events
+    ]
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def bench_handler_emit(benchmark, connector, sinks, events, protocol):
+    """SSLSysLogHandler.emit, one record per event."""
+    if protocol == "TLS" and not hasattr(ssl, "wrap_socket"):
+        pytest.skip("ssl.wrap_socket was removed in Python 3.12")
+    benchmark.group = "syslog send"
+    SSLSysLogHandler = connector("syslog_handler").SSLSysLogHandler
+    handler = SSLSysLogHandler(
+        transform_data=True,
+        protocol=protocol,
+        address=("127.0.0.1", sinks[protocol].port),
+        socktype=None if protocol == "UDP" else socket.SOCK_STREAM,
+    )
+    handler.setFormatter(legacy_formatter())
+    page = records(events)
+
+    def emit():
+        for record in page:
+            handler.emit(record)
+
+    benchmark(emit)
+    handler.close()
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def bench_writer_write_events(benchmark, connector, sinks, event_bytes, protocol):
+    """SyslogWriter.write_events, the batched writes of the push task."""
+    benchmark.group = "syslog send"
+    SyslogWriter = connector("syslog_writer").SyslogWriter
+    writer = SyslogWriter(protocol, ("127.0.0.1", sinks[protocol].port))
+    benchmark(writer.write_events, event_bytes, HEADER)
+    writer.close()
+
+
+def bench_legacy_event_format(benchmark, events):
+    """Per-event json.dumps and logging.Formatter.format."""
+    benchmark.group = "event format"
+    formatter = legacy_formatter()
+
+    def format_page():
+        return [
+            formatter.format(
+                logging.LogRecord("bench", logging.INFO, __file__, 0, json.dumps(event), None, None)
+            ).encode()
+            for event in events
+        ]
+
+    benchmark(format_page)
+
+
+@pytest.mark.parametrize("framing", ("non_transparent", "octet_counting"))
+def bench_encode_and_frame(benchmark, connector, events, framing):
+    """encode_event and iter_batches, the framing of the push task."""
+    benchmark.group = "event format"
+    syslog_writer = connector("syslog_writer")
+
+    def frame_page():
+        encoded = [syslog_writer.encode_event(event) for event in events]
+        return list(syslog_writer.iter_batches(encoded, HEADER, framing))
+
+    benchmark(frame_page)
+
+
+def bench_save_checkpoint(benchmark, connector):
+    benchmark.group = "checkpoint"
+    Checkpoint = connector("checkpoint").Checkpoint
+    checkpoint = {"bench_next_checkpoint": 123456}
+    benchmark(Checkpoint.save_checkpoint_to_file, checkpoint, "bench", seq=1)
+
+
+def bench_save_and_flush_checkpoint(benchmark, connector):
+    """Save and commit, the cost of a commit interval of 1."""
+    benchmark.group = "checkpoint"
+    Checkpoint = connector("checkpoint").Checkpoint
+    checkpoint = {"bench_next_checkpoint": 123456}
+
+    def save():
+        Checkpoint.save_checkpoint_to_file(checkpoint, "bench", seq=1)
+        Checkpoint.flush()
+
+    benchmark(save)
+
+
+def bench_read_checkpoint(benchmark, connector):
+    benchmark.group = "checkpoint"
+    Checkpoint = connector("checkpoint").Checkpoint
+    Checkpoint.save_checkpoint_to_file({"bench_next_checkpoint": 123456}, "bench", seq=1)
+    Checkpoint.flush()
+    assert benchmark(Checkpoint.read_checkpoint_from_file, "bench") == 123456
+
+
+def bench_read_config(benchmark, connector):
+    """read_config, parsing config.json on every call."""
+    benchmark.group = "config"
+    benchmark(connector("validate_config").read_config)
+
+
+def bench_get_config(benchmark, connector):
+    """get_config, the cached config checked against the file."""
+    benchmark.group = "config"
+    benchmark(connector("config").get_config)
+
+
+@pytest.mark.parametrize("serializer_name", ("json", "vectra-json"))
+def bench_page_message(benchmark, connector, page, serializer_name):
+    """Celery message body of a page passed by value."""
+    from kombu.serialization import dumps
+
+    benchmark.group = "celery message"
+    connector("serializer").register_kombu_serializer()
+    message = ([page], {}, {"callbacks": None, "errbacks": None, "chain": None, "chord": None})
+    benchmark(dumps, message, serializer=serializer_name)
+
+
+def bench_reference_message(benchmark, connector):
+    """Celery message body of a page passed by spool reference."""
+    from kombu.serialization import dumps
+
+    benchmark.group = "celery message"
+    serializer = connector("serializer")
+    serializer.register_kombu_serializer()
+    message = ([None, 0], {}, {"callbacks": None, "errbacks": None, "chain": None, "chord": None})
+    benchmark(dumps, message, serializer=serializer.KOMBU_SERIALIZER)
+
@@ -0,0 +1,57 @@
+"""Shared helpers for the connector benchmarks."""
+import importlib
+import os
+import sys
+
+CONNECTOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vectra-connector")
+
+
+def import_connector(module):
+    """Import a module of the vectra-connector package, e.g. 'serializer'."""
+    if CONNECTOR_DIR not in sys.path:
+        sys.path.insert(0, CONNECTOR_DIR)
+    return importlib.import_module(f"vectra-connector.{module}")
+
+
+def detection_event(index):
+    """Return an event shaped like a Vectra v3.3 detection event."""
+    return {
+        "id": 100000 + index,
+        "category": "COMMAND & CONTROL",
+        "detection_id": 4000 + index % 500,
+        "detection_href": f"https://tenant.uw2.portal.vectra.ai/api/v3.3/detections/{4000 + index % 500}",
+        "detection_type": "Hidden HTTPS Tunnel",
+        "entity_id": 200 + index % 50,
+        "entity_uid": f"host-{index % 50}.corp.example.com",
+        "entity_type": "host",
+        "threat": 60 + index % 40,
+        "certainty": 50 + index % 50,
+        "triaged": False,
+        "mitre": ["T1071.001", "T1573.002"],
+        "src_ip": f"10.0.{index % 255}.{index % 200}",
+        "d_type_vname": "Hidden HTTPS Tunnel",
+        "event_timestamp": "2023-05-31T14:10:00Z",
+        "detail": {
+            "dst_ips": ["203.0.113.7"],
+            "dst_ports": [443],
+            "protocol": "tcp",
+            "app_protocol": "https",
+            "bytes_sent": 123456 + index,
+            "bytes_received": 654321 + index,
+            "first_timestamp": "2023-05-31T13:40:00Z",
+            "last_timestamp": "2023-05-31T14:09:00Z",
+            "sessions": [
+                {"dst_port": 443, "duration": 120 + index % 60, "tunnel_type": "Long TCP session"}
+                for _ in range(3)
+            ],
+        },
+    }
+
+
+def detection_page(size=1000, start=0):
+    """Return an API response body with ``size`` detection events."""
+    return {
+        "events": [detection_event(start + index) for index in range(size)],
+        "next_checkpoint": start + size,
+        "remaining_count": 0,
+    }
@@ -0,0 +1,85 @@
+"""Fixtures of the pytest-benchmark suite.
+
+Run from the repository root:
+
+    python -m pytest benchmarks
+
+Every run is saved under ./.benchmarks with the commit it ran on. Compare
+a change with the last saved run using ``--benchmark-compare``, or list
+the trend of one benchmark across runs with
+``pytest-benchmark compare --group-by=name``.
+
+The connector modules run from a temporary directory with a minimal
+config.json, and the syslog benchmarks send to the sinks of
+syslog_sink.py.
+"""
+import json
+import os
+import shutil
+import tempfile
+import pytest
+from common import detection_page, import_connector
+from syslog_sink import SyslogSink, make_certificate
+
+WORKDIR = tempfile.mkdtemp(prefix="vectra-microbench-")
+os.makedirs(os.path.join(WORKDIR, "cert"))
+with open(os.path.join(WORKDIR, "config.json"), "w") as f:
+    json.dump(
+        {
+            "configuration": {
+                "server": [
+                    {
+                        "name": "bench",
+                        "server_protocol": "TCP",
+                        "server_host": "127.0.0.1",
+                        "server_port": 9,
+                    }
+                ],
+                "scheduler": {
+                    "audit": "* * * * *",
+                    "detections": "* * * * *",
+                    "entity_scoring": "* * * * *",
+                },
+                "retry_count": 2,
+                "checkpoint_commit_interval": 1,
+            }
+        },
+        f,
+    )
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir():
+    """Run the connector modules from the temporary directory.
+
+    Connector modules read and write relative to the working directory.
+    Results are still saved relative to the directory pytest started in.
+    """
+    started_in = os.getcwd()
+    os.chdir(WORKDIR)
+    yield WORKDIR
+    os.chdir(started_in)
+    shutil.rmtree(WORKDIR, True)
+
+
+@pytest.fixture(scope="session")
+def page():
+    """Body of a page with 1000 detection events."""
+    return detection_page(1000)
+
+
+@pytest.fixture(scope="session")
+def connector():
+    """Import a module of the connector, e.g. connector('spool')."""
+    return import_connector
+
+
+@pytest.fixture(scope="session")
+def sinks():
+    """UDP, TCP and TLS syslog sinks keyed by protocol."""
+    certificate = (os.path.join(WORKDIR, "cert", "sink.pem"), os.path.join(WORKDIR, "sink.key"))
+    make_certificate(*certificate)
+    started = {protocol: SyslogSink(protocol, certificate) for protocol in ("UDP", "TCP", "TLS")}
+    yield started
+    for sink in started.values():
+        sink.result()
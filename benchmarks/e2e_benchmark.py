@@ -0,0 +1,281 @@
+"""End-to-end throughput of the connector against a fake Vectra API and local syslog sinks.
+
+Run from the repository root:
+
+    python benchmarks/e2e_benchmark.py --events 100000 --protocol tcp --protocol tls
+
+The fake API and one sink per protocol run in child processes. The
+connector runs in this process from a temporary working directory: the
+real collect_stream task pulls every page of the stream, and with Celery
+in eager mode each spooled page is pushed by the real
+push_data_to_syslog task as soon as it is enqueued, without a broker.
+The report shows events per second, end-to-end latency from the API
+response to the sink, and CPU seconds and peak RSS of every component.
+Per-component figures need psutil, otherwise only the connector is
+measured.
+"""
+import argparse
+import atexit
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from common import import_connector
+from fake_vectra import start_fake_vectra
+from syslog_sink import SyslogSink, make_certificate
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+STREAMS = ("audit", "detections", "entity_account", "entity_host")
+
+
+class ResourceMonitor:
+    """CPU time and peak RSS of processes while the benchmark runs."""
+
+    def __init__(self, components, interval=0.1) -> None:
+        """Initialization function
+
+        Args:
+            components (dict): Component name to process id
+            interval (float): Seconds between two RSS samples
+        """
+        self.interval = interval
+        self.processes = {}
+        self.peak_rss = {}
+        if psutil is not None:
+            self.processes = {name: psutil.Process(pid) for name, pid in components.items()}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _cpu_times(self):
+        times = {}
+        for name, process in self.processes.items():
+            cpu = process.cpu_times()
+            times[name] = cpu.user + cpu.system
+        return times
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            for name, process in self.processes.items():
+                try:
+                    rss = process.memory_info().rss
+                except psutil.Error:
+                    continue
+                self.peak_rss[name] = max(self.peak_rss.get(name, 0), rss)
+
+    def start(self):
+        self._start_cpu = self._cpu_times()
+        self._start_self = resource.getrusage(resource.RUSAGE_SELF)
+        self._thread.start()
+
+    def stop(self):
+        """Return the CPU seconds and peak RSS in MiB of every component."""
+        self._stopped.set()
+        self._thread.join()
+        end = self._cpu_times()
+        usage = {
+            name: {
+                "cpu_seconds": end[name] - self._start_cpu[name],
+                "peak_rss_mib": self.peak_rss.get(name, 0) / 2**20,
+            }
+            for name in self.processes
+        }
+        if "connector" not in usage:
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            usage["connector"] = {
+                "cpu_seconds": own.ru_utime + own.ru_stime
+                - self._start_self.ru_utime - self._start_self.ru_stime,
+                # ru_maxrss is in KiB on Linux
+                "peak_rss_mib": own.ru_maxrss / 1024,
+            }
+        return usage
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def write_config(sinks, args):
+    servers = [
+        {
+            "name": f"{sink.protocol.lower()}-sink",
+            "server_protocol": sink.protocol,
+            "server_host": "127.0.0.1",
+            "server_port": sink.port,
+        }
+        for sink in sinks
+    ]
+    config = {
+        "configuration": {
+            "server": servers,
+            "scheduler": {
+                "audit": "* * * * *",
+                "detections": "* * * * *",
+                "entity_scoring": "* * * * *",
+            },
+            "retry_count": 3,
+            "page_size": args.page_size,
+            "api_requests_per_minute": args.requests_per_minute,
+            "stream_parsing": args.stream_parsing,
+            "metrics_port": 0,
+        }
+    }
+    with open("config.json", "w") as f:
+        json.dump(config, f, indent=4)
+
+
+def wait_for_sinks(sinks, expected, timeout):
+    """Wait until every sink received the expected frames or stopped receiving."""
+    deadline = time.monotonic() + timeout
+    last_frames = None
+    idle_since = time.monotonic()
+    while time.monotonic() < deadline:
+        frames = [sink.stats()["frames"] for sink in sinks]
+        if all(count >= expected for count in frames):
+            return
+        if frames != last_frames:
+            last_frames, idle_since = frames, time.monotonic()
+        elif time.monotonic() - idle_since > 5:
+            # e.g. datagrams lost by a UDP sink
+            return
+        time.sleep(0.05)
+
+
+def run(args):
+    protocols = [protocol.upper() for protocol in args.protocol or ["tcp"]]
+    workdir = tempfile.mkdtemp(prefix="vectra-bench-")
+    os.makedirs(os.path.join(workdir, "cert"))
+    sinks = []
+    for protocol in protocols:
+        certificate = None
+        if protocol == "TLS":
+            certificate = (
+                os.path.join(workdir, "cert", "tls-sink.pem"),
+                os.path.join(workdir, "tls-sink.key"),
+            )
+            make_certificate(*certificate)
+        sinks.append(SyslogSink(protocol, certificate))
+    api_process, base_url = start_fake_vectra(
+        events=args.events,
+        latency=args.api_latency,
+        throttle_every=args.throttle_every,
+        retry_after=args.retry_after,
+        compress=args.gzip,
+    )
+
+    # Connector modules keep writing relative paths until the interpreter exits
+    os.chdir(workdir)
+    if not args.keep:
+        atexit.register(shutil.rmtree, workdir, True)
+    try:
+        write_config(sinks, args)
+        os.environ.update(
+            {
+                "BASE_URL": base_url,
+                "CLIENT_ID": "bench",
+                "CLIENT_SECRET": "bench",
+                "rabbitmq_user": "bench",
+                "rabbitmq_pass": "bench",
+            }
+        )
+        # Tasks run in the calling process instead of being sent to RabbitMQ
+        import_connector("celery").app.conf.task_always_eager = True
+        tasks = import_connector("tasks")
+
+        components = {"api": api_process.pid, "connector": os.getpid()}
+        components.update({f"{sink.protocol.lower()}-sink": sink.process.pid for sink in sinks})
+        monitor = ResourceMonitor(components)
+        monitor.start()
+        started = time.time()
+        tasks.collect_stream(args.stream)
+        collected = time.time()
+        wait_for_sinks(sinks, args.events, args.timeout)
+        usage = monitor.stop()
+        results = [sink.result() for sink in sinks]
+        with open(os.path.join("logs", "vectra_syslog_connector.log")) as f:
+            stages = [line.strip() for line in f if "Stages of" in line]
+    finally:
+        api_process.terminate()
+
+    report = {
+        "events": args.events,
+        "stream": args.stream,
+        "page_size": args.page_size,
+        "collect_seconds": collected - started,
+        "sinks": {},
+        "usage": usage,
+    }
+    for sink, result in zip(sinks, results):
+        elapsed = (result["last"] or started) - started
+        latencies = result["latencies"]
+        report["sinks"][f"{sink.protocol.lower()}-sink"] = {
+            "frames": result["frames"],
+            "bytes": result["bytes"],
+            "seconds": elapsed,
+            "events_per_second": result["frames"] / elapsed if elapsed > 0 else 0,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p99": percentile(latencies, 0.99),
+        }
+    return report, stages
+
+
+def print_report(report, stages):
+    print(
+        f"{report['events']} {report['stream']} events, pages of {report['page_size']}, "
+        f"collected in {report['collect_seconds']:.2f}s"
+    )
+    print(f"{'sink':<12} {'frames':>10} {'events/s':>12} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, sink in report["sinks"].items():
+        p50 = f"{sink['latency_p50'] * 1000:.1f}" if sink["latency_p50"] is not None else "-"
+        p99 = f"{sink['latency_p99'] * 1000:.1f}" if sink["latency_p99"] is not None else "-"
+        print(f"{name:<12} {sink['frames']:>10} {sink['events_per_second']:>12.0f} {p50:>10} {p99:>10}")
+    print(f"{'component':<12} {'cpu s':>10} {'peak MiB':>12}")
+    for name, usage in report["usage"].items():
+        print(f"{name:<12} {usage['cpu_seconds']:>10.2f} {usage['peak_rss_mib']:>12.1f}")
+    if psutil is None:
+        print("Install psutil to measure the API and sink processes.")
+    for line in stages[-3:]:
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure connector throughput end to end.")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--stream", choices=STREAMS, default="detections")
+    parser.add_argument(
+        "--protocol", action="append", choices=["udp", "tcp", "tls"], help="Repeat for several sinks"
+    )
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--requests-per-minute", type=float, default=60000)
+    parser.add_argument("--api-latency", type=float, default=0, help="Seconds added per page")
+    parser.add_argument("--throttle-every", type=int, default=0, help="429 on every n-th page")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--gzip", action="store_true", help="gzip the API responses")
+    parser.add_argument("--stream-parsing", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    report, stages = run(args)
+    print_report(report, stages)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+    if any(sink["frames"] < args.events for sink in report["sinks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
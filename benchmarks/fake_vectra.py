@@ -0,0 +1,184 @@
+"""Local stand-in for the Vectra API used by the end-to-end benchmark.
+
+Serves ``POST /oauth2/token`` and paginated ``GET /api/v3.3/events/*``
+with ``from``/``limit``, ``next_checkpoint`` and ``remaining_count``.
+Every event carries a ``bench_ts`` field with the time its page was
+served, which the syslog sinks use to measure end-to-end latency.
+
+Run on its own with ``python benchmarks/fake_vectra.py --events 100000``
+or start it from a benchmark with ``start_fake_vectra``.
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from common import detection_event
+
+# Distinct event bodies, events with the same index modulo TEMPLATES differ only in id
+TEMPLATES = 1000
+TS_MARKER = b'"bench_ts":0.0'
+ID_MARKER = b'"id":-1,'
+
+
+class FakeVectra:
+    """Event pages of a fixed number of events."""
+
+    def __init__(self, events, latency=0, throttle_every=0, retry_after=1, compress=False) -> None:
+        """Initialization function
+
+        Args:
+            events (int): Events returned in total by every event endpoint
+            latency (float): Seconds added to every page response
+            throttle_every (int): Answer every n-th page request with 429, 0 never
+            retry_after (int): Retry-After seconds of the 429 responses
+            compress (bool): gzip the page responses
+        """
+        self.events = events
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.compress = compress
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self.templates = [
+            json.dumps(
+                dict(detection_event(index), id=-1, bench_ts=0.0), separators=(",", ":")
+            ).encode()
+            for index in range(TEMPLATES)
+        ]
+
+    def page(self, start, limit):
+        """Return the body of the page starting at checkpoint ``start``."""
+        end = min(self.events, start + limit)
+        ts = b'"bench_ts":%r' % time.time()
+        events = b",".join(
+            self.templates[index % TEMPLATES]
+            .replace(ID_MARKER, b'"id":%d,' % index, 1)
+            .replace(TS_MARKER, ts, 1)
+            for index in range(start, end)
+        )
+        return b'{"events":[%s],"next_checkpoint":%d,"remaining_count":%d}' % (
+            events,
+            end,
+            self.events - end,
+        )
+
+    def should_throttle(self):
+        with self._lock:
+            self.requests += 1
+            if self.throttle_every and self.requests % self.throttle_every == 0:
+                self.throttled += 1
+                return True
+        return False
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_body(self, status, body, headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path != "/oauth2/token":
+                self.send_body(404, b"{}")
+                return
+            self.send_body(
+                200,
+                b'{"access_token":"bench","refresh_token":"bench","expires_in":21600}',
+            )
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.startswith("/api/v3.3/events/"):
+                self.send_body(404, b"{}")
+                return
+            if api.should_throttle():
+                self.send_body(429, b"{}", [("Retry-After", str(api.retry_after))])
+                return
+            query = parse_qs(url.query)
+            start = int(query.get("from", ["0"])[0] or 0)
+            limit = int(query.get("limit", ["1000"])[0])
+            if api.latency:
+                time.sleep(api.latency)
+            body = api.page(start, limit)
+            headers = []
+            if api.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=1)
+                headers.append(("Content-Encoding", "gzip"))
+            self.send_body(200, body, headers)
+
+        def log_message(self, format, *args):
+            return
+
+    return Handler
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections are not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(port, ready, options):
+    api = FakeVectra(**options)
+    server = QuietServer(("127.0.0.1", port), make_handler(api))
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def start_fake_vectra(port=0, **options):
+    """Start the fake API in a child process.
+
+    Args:
+        port (int): TCP port, 0 picks a free one
+        options: Arguments of FakeVectra
+
+    Returns:
+        tuple: (process, base URL)
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(port, ready, options), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{ready.get(timeout=30)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Vectra API.")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds added per page")
+    parser.add_argument("--throttle-every", type=int, default=0, help="429 on every n-th page")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+    process, url = start_fake_vectra(
+        args.port,
+        events=args.events,
+        latency=args.latency,
+        throttle_every=args.throttle_every,
+        retry_after=args.retry_after,
+        compress=args.gzip,
+    )
+    print(f"Fake Vectra API on {url}")
+    process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare the stdlib json and the fast JSON backend on connector payloads.
+
+Run from the repository root:
+
+    python benchmarks/serializer_benchmark.py
+
+The fast rows use orjson when it is installed and fall back to stdlib
+json otherwise. The last table shows the size of the Celery task message
+body of a detection page passed by value and by spool reference, with
+each serializer and compression that is installed.
+"""
+import json
+import timeit
+from kombu import compression
+from kombu.serialization import dumps as kombu_dumps
+from common import detection_page, import_connector
+
+serializer = import_connector("serializer")
+
+# Arguments, keyword arguments and embed of a push task message, as Celery sends them
+EMBED = {"callbacks": None, "errbacks": None, "chain": None, "chord": None}
+# Push tasks read the page from the spool and only get the server index
+REFERENCE_MESSAGE = ([None, 0], {}, EMBED)
+
+
+def measure(label, func, per, number, unit="event"):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{label:<40} {seconds / per * 1e6:>10.2f} us/{unit}")
+
+
+def message_sizes(page):
+    """Print the body size and encode time of task messages for a page."""
+    serializer.register_kombu_serializer()
+    messages = {"by value": ([page], {}, EMBED), "by reference": REFERENCE_MESSAGE}
+    serializers = ["json", serializer.KOMBU_SERIALIZER]
+    try:
+        import msgpack  # noqa: F401
+
+        serializers.append("msgpack")
+    except ImportError:
+        pass
+    compressions = [None]
+    for name in ("zlib", "zstd"):
+        try:
+            compression.get_encoder(name)
+            compressions.append(name)
+        except KeyError:
+            pass
+
+    print(f"{'task message':<40} {'bytes':>10} {'us/message':>12}")
+    for label, message in messages.items():
+        number = 10 if label == "by value" else 10000
+        for serializer_name in serializers:
+            for compression_name in compressions:
+
+                def encode():
+                    body = kombu_dumps(message, serializer=serializer_name)[2]
+                    if isinstance(body, str):
+                        body = body.encode()
+                    if compression_name is not None:
+                        body = compression.compress(body, compression_name)[0]
+                    return body
+
+                seconds = min(timeit.repeat(encode, number=number, repeat=5)) / number
+                name = f"{label}, {serializer_name}" + (f"+{compression_name}" if compression_name else "")
+                print(f"{name:<40} {len(encode()):>10} {seconds * 1e6:>12.1f}")
+
+
+def main():
+    page = detection_page(1000)
+    events = page["events"]
+    body = json.dumps(page).encode()
+    checkpoint = {"detection_next_checkpoint": 123456}
+
+    print(f"fast backend: {serializer.BACKEND}, page: {len(events)} events, {len(body)} bytes")
+    measure("event encode, json.dumps().encode()", lambda: [json.dumps(e).encode() for e in events], 1000, 20)
+    measure("event encode, serializer.dumps()", lambda: [serializer.dumps(e) for e in events], 1000, 20)
+    measure("page decode, json.loads()", lambda: json.loads(body), 1000, 20)
+    measure("page decode, serializer.loads()", lambda: serializer.loads(body), 1000, 20)
+    measure("checkpoint encode, json.dumps()", lambda: json.dumps(checkpoint), 1, 20000, "call")
+    measure("checkpoint encode, serializer.dumps()", lambda: serializer.dumps(checkpoint), 1, 20000, "call")
+    measure("full page message, json.dumps()", lambda: json.dumps(([page], {}, EMBED)), 1000, 10)
+    measure("full page message, serializer.dumps()", lambda: serializer.dumps(([page], {}, EMBED)), 1000, 10)
+    measure("reference message, serializer.dumps()", lambda: serializer.dumps(REFERENCE_MESSAGE), 1, 20000, "call")
+    print()
+    message_sizes(page)
+
+
+if __name__ == "__main__":
+    main()
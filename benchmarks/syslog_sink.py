@@ -0,0 +1,158 @@
+"""Local UDP, TCP and TLS syslog servers that count and timestamp frames.
+
+Each sink runs in its own process so its CPU time is measured apart from
+the connector. Frames are newline terminated (non_transparent framing).
+The latency of a frame is its arrival time minus the ``bench_ts`` the
+fake Vectra API put into the event.
+"""
+import multiprocessing
+import re
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+TS_PATTERN = re.compile(rb'"bench_ts":([0-9.e+-]+)')
+
+
+class FrameCounter:
+    """Frames and latencies received by one sink."""
+
+    def __init__(self) -> None:
+        """Initialization function"""
+        self.frames = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def add(self, data, frames):
+        now = time.time()
+        latencies = [now - float(ts) for ts in TS_PATTERN.findall(data)]
+        with self._lock:
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self.frames += frames
+            self.bytes += len(data)
+            self.latencies.extend(latencies)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "first": self.first,
+                "last": self.last,
+            }
+
+
+def serve_udp(sock, counter):
+    while True:
+        data = sock.recv(65535)
+        counter.add(data, 1)
+
+
+def serve_stream(connection, counter):
+    rest = b""
+    with connection:
+        while True:
+            try:
+                chunk = connection.recv(262144)
+            except OSError:
+                return
+            if not chunk:
+                return
+            data = rest + chunk
+            end = data.rfind(b"\n") + 1
+            if end:
+                complete, rest = data[:end], data[end:]
+                counter.add(complete, complete.count(b"\n"))
+            else:
+                rest = data
+
+
+def serve(protocol, ready, commands, certificate):
+    counter = FrameCounter()
+    if protocol == "UDP":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        sock.bind(("127.0.0.1", 0))
+        threading.Thread(target=serve_udp, args=(sock, counter), daemon=True).start()
+    else:
+        sock = socket.create_server(("127.0.0.1", 0))
+        context = None
+        if protocol == "TLS":
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*certificate)
+
+        def accept():
+            while True:
+                connection, _ = sock.accept()
+                if context is not None:
+                    try:
+                        connection = context.wrap_socket(connection, server_side=True)
+                    except (OSError, ssl.SSLError):
+                        # e.g. the connectivity check of the connector
+                        continue
+                threading.Thread(
+                    target=serve_stream, args=(connection, counter), daemon=True
+                ).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+    ready.put(sock.getsockname()[1])
+    while True:
+        command = commands.recv()
+        if command == "stats":
+            commands.send(counter.stats())
+        elif command == "result":
+            result = counter.stats()
+            result["latencies"] = counter.latencies
+            commands.send(result)
+            return
+
+
+class SyslogSink:
+    """A sink process and the pipe to query it."""
+
+    def __init__(self, protocol, certificate=None) -> None:
+        """Initialization function
+
+        Args:
+            protocol (str): UDP, TCP or TLS
+            certificate (tuple): Certificate and key file, required for TLS
+        """
+        self.protocol = protocol.upper()
+        ready = multiprocessing.Queue()
+        self._commands, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve, args=(self.protocol, ready, child, certificate), daemon=True
+        )
+        self.process.start()
+        self.port = ready.get(timeout=30)
+
+    def stats(self):
+        """Return frames, bytes and the first and last arrival time."""
+        self._commands.send("stats")
+        return self._commands.recv()
+
+    def result(self):
+        """Stop the sink and return its stats with all latencies."""
+        self._commands.send("result")
+        result = self._commands.recv()
+        self.process.join(5)
+        return result
+
+
+def make_certificate(certfile, keyfile):
+    """Write a self-signed certificate and its key with openssl."""
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile,
+        ],
+        check=True,
+        capture_output=True,
+    )
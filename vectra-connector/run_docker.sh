@@ -1,7 +1,22 @@
-#!/bin/bash
-
-# Run Celery worker
-celery -A vectra-connector worker --concurrency=8 -l info &
-
-# Run Celery beat
-celery -A vectra-connector beat
+#!/bin/bash
+
+# Metric files of processes from a previous start
+rm -rf ./metrics
+
+ENGINE=$(python -c "import json; print(json.load(open('config.json'))['configuration'].get('engine', 'celery'))")
+
+if [ "$ENGINE" = "asyncio" ]; then
+    # Run collection and forwarding in a single asyncio process
+    exec python -m vectra-connector.engine
+fi
+
+# Run Celery worker for collection tasks
+celery -A vectra-connector worker -Q celery --concurrency=8 -l info &
+
+# Run one delivery worker per syslog server
+for QUEUE in $(python -m vectra-connector.lanes); do
+    celery -A vectra-connector worker -Q "$QUEUE" -n "$QUEUE@%h" --concurrency=1 -l info &
+done
+
+# Run Celery beat
+celery -A vectra-connector beat
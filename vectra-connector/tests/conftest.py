@@ -0,0 +1,167 @@
+"""Fixtures of the connector tests.
+
+Run from the repository root:
+
+    python -m pytest vectra-connector/tests
+
+The connector modules read config.json, authenticate against the Vectra
+API and write their state relative to the working directory when they are
+imported. The tests therefore run from a temporary directory with a
+minimal config.json, against a local stand-in of the Vectra API.
+"""
+import atexit
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+
+CONNECTOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+class FakeVectra:
+    """Event pages of a fixed number of events with ids 0 to events - 1."""
+
+    def __init__(self, events=0) -> None:
+        """Initialization function
+
+        Args:
+            events (int): Events returned in total by every event endpoint
+        """
+        self.events = events
+        self.requests = []
+
+    def page(self, start, limit):
+        end = min(self.events, start + limit)
+        return {
+            "events": [{"id": index, "event_timestamp": "2023-05-31T14:10:00Z"} for index in range(start, end)],
+            "next_checkpoint": end,
+            "remaining_count": self.events - end,
+        }
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json({"access_token": "test", "refresh_token": "test", "expires_in": 21600})
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            start = int(query.get("from", ["0"])[0] or 0)
+            limit = int(query.get("limit", ["1000"])[0])
+            api.requests.append(start)
+            self.send_json(api.page(start, limit))
+
+        def log_message(self, format, *args):
+            return
+
+    return Handler
+
+
+API = FakeVectra()
+_server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(API))
+_server.daemon_threads = True
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+WORKDIR = tempfile.mkdtemp(prefix="vectra-connector-tests-")
+with open(os.path.join(WORKDIR, "config.json"), "w") as f:
+    json.dump(
+        {
+            "configuration": {
+                "server": [
+                    {
+                        "name": "server1",
+                        "server_protocol": "TCP",
+                        "server_host": "127.0.0.1",
+                        "server_port": 9,
+                    }
+                ],
+                "scheduler": {
+                    "audit": "* * * * *",
+                    "detections": "* * * * *",
+                    "entity_scoring": "* * * * *",
+                },
+                "retry_count": 1,
+                "page_size": 1000,
+                "api_requests_per_minute": 60000,
+                "checkpoint_commit_interval": 0,
+                "metrics_port": 0,
+            }
+        },
+        f,
+    )
+os.environ.update(
+    {
+        "BASE_URL": f"http://127.0.0.1:{_server.server_port}",
+        "CLIENT_ID": "test",
+        "CLIENT_SECRET": "test",
+        "rabbitmq_user": "test",
+        "rabbitmq_pass": "test",
+    }
+)
+# Connector modules keep writing relative paths until the interpreter exits,
+# the directory is removed after their exit handlers
+os.chdir(WORKDIR)
+atexit.register(shutil.rmtree, WORKDIR, True)
+
+
+def pytest_unconfigure(config):
+    # pytest changes back to the directory it was started in before the exit handlers
+    os.chdir(WORKDIR)
+
+
+def import_connector(module):
+    """Import a module of the vectra-connector package, e.g. 'spool'."""
+    if CONNECTOR_DIR not in sys.path:
+        sys.path.insert(0, CONNECTOR_DIR)
+    return importlib.import_module(f"vectra-connector.{module}")
+
+
+@pytest.fixture
+def connector():
+    return import_connector
+
+
+@pytest.fixture
+def api():
+    """The fake Vectra API, reset for every test."""
+    API.events = 0
+    API.requests = []
+    return API
+
+
+@pytest.fixture(autouse=True)
+def finished_prefetchers(connector, monkeypatch):
+    """Wait for the prefetchers a test started, e.g. the one of a stopped run.
+
+    A prefetcher still running when pytest changes back to the start
+    directory would write its fetch control state there.
+    """
+    prefetcher = connector("vectra_api").PagePrefetcher
+    start = prefetcher.__init__
+    started = []
+
+    def recording_init(self, *args, **kwargs):
+        start(self, *args, **kwargs)
+        started.append(self)
+
+    monkeypatch.setattr(prefetcher, "__init__", recording_init)
+    yield
+    for pages in started:
+        pages._thread.join(5)
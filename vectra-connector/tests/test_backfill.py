@@ -0,0 +1,63 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+
+
+@pytest.fixture
+def backfill(connector, monkeypatch):
+    backfill = connector("backfill")
+    vectra_api = connector("vectra_api")
+    monkeypatch.setattr(vectra_api.push_data_to_syslog, "apply_async", lambda *args, **kwargs: None)
+    return backfill
+
+
+def test_slice_stopped_early_is_not_marked_done(backfill, api, connector, monkeypatch):
+    vectra_api = connector("vectra_api")
+    api.events = 3000
+    # The spool is full while the slice is pulled and has room again afterwards
+    monkeypatch.setattr(vectra_api, "spool_full", lambda: True)
+
+    assert not backfill.backfill("audit", since=datetime.utcnow() - timedelta(minutes=30))
+
+    state = backfill.read_state("audit")
+    assert [time_slice["done"] for time_slice in state["slices"]] == [False]
+
+    monkeypatch.setattr(vectra_api, "spool_full", lambda: False)
+    assert backfill.backfill("audit")
+
+    assert not os.path.exists(backfill.backfill_state_path("audit"))
+    assert backfill.Checkpoint.read_checkpoint_from_file("audit") == 3000
+
+
+def test_adjacent_slices_do_not_share_their_boundary(backfill, monkeypatch):
+    windows = []
+
+    def fetch_data_from_api(params, **kwargs):
+        windows.append((params["event_timestamp_gte"], params.get("event_timestamp_lte")))
+        return True
+
+    monkeypatch.setattr(backfill.VectraAPI, "fetch_data_from_api", fetch_data_from_api)
+    since = datetime(2023, 5, 31, 12)
+
+    assert backfill.backfill("detections", since=since, until=since + timedelta(hours=2), concurrency=1)
+
+    assert windows == [
+        ("2023-05-31T12:00:00Z", "2023-05-31T12:59:59Z"),
+        ("2023-05-31T13:00:00Z", "2023-05-31T13:59:59Z"),
+    ]
+
+
+def test_only_open_ended_backfill_pauses_live_collection(backfill, connector):
+    tasks = connector("tasks")
+    os.makedirs(tasks.BACKFILL_DIR, exist_ok=True)
+    since = datetime.utcnow() - timedelta(hours=1)
+    state = {"until": None, "slices": backfill.plan_slices(since, None, 1)}
+    backfill.write_state("entity_host", state)
+    assert tasks.live_backfill("entity_host")
+
+    state = {"until": since.strftime(backfill.TIME_FORMAT), "slices": []}
+    backfill.write_state("entity_host", state)
+    assert not tasks.live_backfill("entity_host")
+
+    os.remove(backfill.backfill_state_path("entity_host"))
+    assert not tasks.live_backfill("entity_host")
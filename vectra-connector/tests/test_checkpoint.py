@@ -0,0 +1,59 @@
+import pytest
+
+
+@pytest.fixture
+def checkpoint(connector):
+    return connector("checkpoint")
+
+
+def test_read_without_checkpoint_returns_zero(checkpoint):
+    assert checkpoint.Checkpoint.read_checkpoint_from_file("test_none") == 0
+    assert not checkpoint.Checkpoint.has_checkpoint("test_none")
+
+
+def test_saved_checkpoint_is_read_back(checkpoint):
+    Checkpoint = checkpoint.Checkpoint
+    Checkpoint.save_checkpoint_to_file({"test_saved_next_checkpoint": 3000}, "test_saved")
+    Checkpoint.flush()
+
+    assert Checkpoint.read_checkpoint_from_file("test_saved") == 3000
+
+
+def test_spooled_checkpoint_is_recovered_after_a_crash(checkpoint):
+    Checkpoint = checkpoint.Checkpoint
+    spool = checkpoint.spool
+    seq = spool.append(b"page-1", checkpoint=("test_crash", 1000))
+    Checkpoint.save_checkpoint_to_file({"test_crash_next_checkpoint": 1000}, "test_crash", seq=seq)
+    Checkpoint.flush()
+    # The next page was spooled but the process died before its checkpoint was saved
+    spool.append(b"page-2", checkpoint=("test_crash", 2000))
+
+    assert Checkpoint.read_checkpoint_from_file("test_crash") == 2000
+    # The recovered checkpoint is saved, so it is not recovered again
+    assert checkpoint.checkpoint_store.get("test_crash")[1] == 2000
+
+
+def test_checkpoint_without_spooled_page_is_recovered_after_a_crash(checkpoint):
+    Checkpoint = checkpoint.Checkpoint
+    spool = checkpoint.spool
+    seq = spool.append(b"page-1", checkpoint=("test_filtered", 1000))
+    Checkpoint.save_checkpoint_to_file({"test_filtered_next_checkpoint": 1000}, "test_filtered", seq=seq)
+    # A page without events advances the checkpoint without the spool
+    Checkpoint.save_checkpoint_to_file({"test_filtered_next_checkpoint": 1500}, "test_filtered")
+    assert spool.checkpoint("test_filtered") == (seq, 1500)
+
+    # The process died before the store committed the new value
+    checkpoint.checkpoint_store.set("test_filtered", 1000, seq=seq)
+
+    assert Checkpoint.read_checkpoint_from_file("test_filtered") == 1500
+
+
+def test_deleted_checkpoint_is_gone_from_store_and_spool(checkpoint):
+    Checkpoint = checkpoint.Checkpoint
+    checkpoint.spool.append(b"page-1", checkpoint=("test_deleted", 1000))
+    assert Checkpoint.has_checkpoint("test_deleted")
+
+    Checkpoint.delete_checkpoint("test_deleted")
+
+    assert not Checkpoint.has_checkpoint("test_deleted")
+    assert Checkpoint.read_checkpoint_from_file("test_deleted") == 0
@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.fixture
+def dedup(connector, tmp_path):
+    module = connector("dedup")
+    cache = module.DedupCache(str(tmp_path / "dedup.db"))
+    return module.StreamDedup("entity_scoring", ["entity_id"], cache=cache)
+
+
+def test_repeated_identities_are_dropped(dedup):
+    events = [{"entity_id": 1}, {"entity_id": 2}, {"entity_id": 1}]
+    kept, keys, dropped = dedup.drop_seen(events, [dedup.key(event) for event in events])
+    assert kept == events[:2]
+    assert dropped == 1
+
+    dedup.remember(keys)
+    kept, _, dropped = dedup.drop_seen(events[:1], [dedup.key(events[0])])
+    assert kept == []
+    assert dropped == 1
+
+
+def test_events_without_key_fields_are_kept(dedup):
+    events = [{"id": index} for index in range(5)]
+    keys = [dedup.key(event) for event in events]
+    assert keys == [None] * 5
+
+    kept, kept_keys, dropped = dedup.drop_seen(events, keys)
+    assert kept == events
+    assert dropped == 0
+
+    dedup.remember(kept_keys)
+    assert dedup.stats()["entries"] == 0
+    assert dedup.drop_seen(events, keys)[0] == events
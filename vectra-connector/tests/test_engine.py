@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def engine(connector):
+    return connector("engine")
+
+
+@pytest.fixture
+def engine_spool(engine, connector, tmp_path, monkeypatch):
+    """Spool of the engine with one page of event ids 0 to 2."""
+    segment_spool = connector("spool").SegmentSpool(str(tmp_path / "spool"))
+    segment_spool.append(b'{"id":0}\n{"id":1}\n{"id":2}', checkpoint=("test_engine", 3))
+    monkeypatch.setattr(engine, "spool", segment_spool)
+    monkeypatch.setattr(engine, "BREAKER_POLL_INTERVAL", 0.01)
+    return segment_spool
+
+
+def test_run_engine_keeps_pages_of_an_open_server_in_the_spool(engine, engine_spool, connector, monkeypatch):
+    received = []
+
+    async def sink(reader, writer):
+        # Pushed connections stay open, keep what arrives
+        while data := await reader.read(65536):
+            received.append(data)
+
+    async def scenario():
+        server = await asyncio.start_server(sink, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        config = connector("config").ConnectorConfig.from_json(
+            {
+                "configuration": {
+                    "server": [
+                        {"name": name, "server_protocol": "TCP", "server_host": "127.0.0.1", "server_port": port}
+                        for name in ("up", "down")
+                    ],
+                    "retry_count": 1,
+                }
+            }
+        )
+        monkeypatch.setattr(engine, "get_config", lambda: config)
+        monkeypatch.setattr(engine, "STREAMS", {})
+        # The breaker of 'down' opened at startup
+        monkeypatch.setattr(engine, "allow_request", lambda name: name != "down")
+        monkeypatch.setattr(engine, "record_success", lambda name: None)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(engine.run_engine(), 0.5)
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(scenario())
+
+    assert b'{"id":2}' in b"".join(received)
+    assert not engine_spool.pending("up")
+    # The page waits for 'down' in the spool, it is neither sent nor dropped
+    assert engine_spool.pending("down")
+    assert engine_spool.checkpoint("test_engine") == (1, 3)
+
+
+def test_writer_sends_spooled_pages_once_the_breaker_closes(engine, engine_spool, monkeypatch):
+    server = engine.get_config().servers[0]
+    writer = engine.AsyncSyslogWriter(server, 1)
+    sent = []
+    failing = [True]
+
+    async def send(events):
+        if failing[0]:
+            raise OSError("Connection refused")
+        sent.extend(events)
+
+    breaker = {"open": False}
+    monkeypatch.setattr(writer, "send", send)
+    monkeypatch.setattr(engine, "allow_request", lambda name: not breaker["open"])
+    monkeypatch.setattr(engine, "record_failure", lambda name: breaker.update(open=True))
+    monkeypatch.setattr(engine, "record_success", lambda name: None)
+
+    async def scenario():
+        task = asyncio.ensure_future(writer.run())
+        await asyncio.sleep(0.1)
+        # One failed send opened the breaker, the page stays unread
+        assert breaker["open"]
+        assert engine_spool.pending(server.name)
+        failing[0] = False
+        breaker["open"] = False
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(scenario())
+
+    assert sent == [b'{"id":0}', b'{"id":1}', b'{"id":2}']
+    assert not engine_spool.pending(server.name)
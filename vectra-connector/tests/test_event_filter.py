@@ -0,0 +1,41 @@
+import pytest
+
+
+@pytest.fixture
+def event_filter(connector):
+    return connector("event_filter")
+
+
+def test_list_fields_compare_with_eq_and_ne(event_filter):
+    event = {"mitre": ["a", "b"]}
+    equal = event_filter.compile_filter(
+        {"conditions": [{"field": "mitre", "operator": "eq", "value": ["a", "b"]}]}
+    )
+    not_equal = event_filter.compile_filter(
+        {"conditions": [{"field": "mitre", "operator": "ne", "value": ["a", "b"]}]}
+    )
+
+    assert equal(event) == event
+    assert not_equal(event) is None
+    assert equal({"mitre": ["b", "a"]}) is None
+
+
+def test_in_matches_any_listed_value(event_filter):
+    matches = event_filter.compile_filter(
+        {"conditions": [{"field": "category", "operator": "in", "value": ["lateral", "exfiltration"]}]}
+    )
+
+    assert matches({"category": "lateral"}) is not None
+    assert matches({"category": "botnet"}) is None
+
+
+def test_kept_events_are_keyed_before_the_projection(event_filter):
+    compiled = event_filter.compile_filter(
+        {"conditions": [{"field": "score", "operator": "gte", "value": 50}], "fields": ["score"]}
+    )
+    events = [{"id": 1, "score": 70}, {"id": 2, "score": 10}, {"id": 3, "score": 90}]
+
+    kept, keys = event_filter.filter_keyed_events(events, compiled, lambda event: event["id"])
+
+    assert kept == [{"score": 70}, {"score": 90}]
+    assert keys == [1, 3]
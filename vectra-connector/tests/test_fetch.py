@@ -0,0 +1,80 @@
+import errno
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def vectra_api(connector, monkeypatch):
+    vectra_api = connector("vectra_api")
+    # Pages are pushed by the delivery lanes, not by these tests
+    monkeypatch.setattr(vectra_api.push_data_to_syslog, "apply_async", lambda *args, **kwargs: None)
+    return vectra_api
+
+
+@pytest.fixture
+def spooled(vectra_api, monkeypatch):
+    """Event ids of the pages appended to the spool, failing on chosen appends."""
+    spool = vectra_api.spool
+    append = spool.append
+    pages = []
+    # Indexes of the append calls that fail
+    failures = set()
+    calls = []
+
+    def recording_append(payload, checkpoint=None):
+        calls.append(checkpoint)
+        if len(calls) - 1 in failures:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        pages.append([json.loads(event)["id"] for event in bytes(payload).split(b"\n")])
+        return append(payload, checkpoint=checkpoint)
+
+    monkeypatch.setattr(spool, "append", recording_append)
+    return pages, failures
+
+
+def fetch(vectra_api, filename):
+    return vectra_api.VectraAPI.fetch_data_from_api(
+        url=f"{os.environ['BASE_URL']}/api/v3.3/events/detections", filename=filename, params={}
+    )
+
+
+def test_all_pages_are_spooled_and_checkpointed(vectra_api, api, spooled):
+    pages, _ = spooled
+    api.events = 3000
+
+    assert fetch(vectra_api, "test_fetch_all") is True
+
+    assert [page[0] for page in pages] == [0, 1000, 2000]
+    assert vectra_api.Checkpoint.read_checkpoint_from_file("test_fetch_all") == 3000
+
+
+def test_failed_page_stops_the_run_without_skipping_it(vectra_api, api, spooled):
+    pages, failures = spooled
+    api.events = 3000
+    # The second page cannot be spooled
+    failures.add(1)
+
+    assert fetch(vectra_api, "test_fetch_failed") is False
+
+    assert [page[0] for page in pages] == [0]
+    assert vectra_api.Checkpoint.read_checkpoint_from_file("test_fetch_failed") == 1000
+
+    api.requests = []
+    assert fetch(vectra_api, "test_fetch_failed") is True
+
+    # The prefetcher of the stopped run may still request a page ahead
+    assert min(api.requests) == 1000
+    assert [event for page in pages for event in page] == list(range(3000))
+    assert vectra_api.Checkpoint.read_checkpoint_from_file("test_fetch_failed") == 3000
+
+
+def test_full_spool_stops_the_run_early(vectra_api, api, spooled, monkeypatch):
+    pages, _ = spooled
+    api.events = 3000
+    monkeypatch.setattr(vectra_api, "spool_full", lambda: True)
+
+    assert fetch(vectra_api, "test_fetch_full") is False
+
+    assert pages == []
+    assert vectra_api.Checkpoint.read_checkpoint_from_file("test_fetch_full") == 0
@@ -0,0 +1,30 @@
+import os
+
+
+def test_update_json_replaces_the_file_only_when_the_state_changed(connector, tmp_path):
+    process_state = connector("process_state")
+    path = str(tmp_path / "state.json")
+
+    assert process_state.update_json(path, lambda state: state.setdefault("count", 1)) == 1
+    written = os.stat(path).st_ino
+    process_state.update_json(path, lambda state: state.setdefault("count", 2))
+    assert os.stat(path).st_ino == written
+
+    process_state.update_json(path, lambda state: state.update(count=3))
+    assert os.stat(path).st_ino != written
+    assert process_state.update_json(path, lambda state: state["count"]) == 3
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_process_local_value_is_built_again_in_a_forked_process(connector, monkeypatch):
+    process_state = connector("process_state")
+    local = process_state.ProcessLocal(dict)
+    value = local.get()
+    assert local.get() is value
+    assert local.built()
+
+    # A forked worker has a new pid
+    monkeypatch.setattr(process_state.os, "getpid", lambda: -1)
+    assert not local.built()
+    assert local.get() is not value
+    assert local.built()
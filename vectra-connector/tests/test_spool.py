@@ -0,0 +1,147 @@
+import os
+import pytest
+
+
+@pytest.fixture
+def spool_module(connector):
+    return connector("spool")
+
+
+@pytest.fixture
+def segment_spool(spool_module, tmp_path):
+    return spool_module.SegmentSpool(str(tmp_path / "spool"))
+
+
+def test_append_assigns_sequence_numbers_and_commits_checkpoint(segment_spool):
+    assert segment_spool.append(b"page-1", checkpoint=("detection", 1000)) == 1
+    assert segment_spool.append(b"page-2", checkpoint=("detection", 2000)) == 2
+    assert segment_spool.append(b"page-3") == 3
+
+    assert segment_spool.checkpoint("detection") == (2, 2000)
+    assert segment_spool.checkpoint("audit") is None
+
+
+def test_read_does_not_consume_until_ack(segment_spool):
+    for index in range(3):
+        segment_spool.append(b"page-%d" % index)
+
+    records = segment_spool.read("server1", max_records=2)
+    assert [(seq, bytes(payload)) for _, seq, payload in records] == [(1, b"page-0"), (2, b"page-1")]
+    # An unacknowledged page is read again, e.g. after a failed push
+    assert [seq for _, seq, _ in segment_spool.read("server1")] == [1, 2, 3]
+
+    segment_spool.ack("server1", records[-1][0])
+    assert [seq for _, seq, _ in segment_spool.read("server1")] == [3]
+    assert segment_spool.pending("server1")
+
+
+def test_destinations_have_their_own_positions(segment_spool):
+    segment_spool.append(b"page-1")
+    segment_spool.append(b"page-2")
+
+    records = segment_spool.read("server1")
+    segment_spool.ack("server1", records[-1][0])
+
+    assert not segment_spool.pending("server1")
+    assert [seq for _, seq, _ in segment_spool.read("server2")] == [1, 2]
+
+
+def test_positions_and_head_survive_a_restart(spool_module, segment_spool):
+    segment_spool.append(b"page-1", checkpoint=("detection", 1000))
+    segment_spool.append(b"page-2", checkpoint=("detection", 2000))
+    segment_spool.ack("server1", segment_spool.read("server1", max_records=1)[0][0])
+
+    reopened = spool_module.SegmentSpool(segment_spool.directory)
+
+    assert reopened.checkpoint("detection") == (2, 2000)
+    assert [bytes(payload) for _, _, payload in reopened.read("server1")] == [b"page-2"]
+    assert reopened.append(b"page-3") == 3
+
+
+def test_torn_write_is_dropped_by_the_next_append(segment_spool):
+    segment_spool.append(b"page-1", checkpoint=("detection", 1000))
+    segment, end = segment_spool.head()
+    # A crash after writing a record but before the head was updated
+    with open(segment_spool._segment_path(segment), "ab") as f:
+        f.write(b"\x00\x00\x10\x00torn record")
+
+    assert [seq for _, seq, _ in segment_spool.read("server1")] == [1]
+    assert segment_spool.checkpoint("detection") == (1, 1000)
+
+    assert segment_spool.append(b"page-2") == 2
+    records = segment_spool.read("server1")
+    assert [(seq, bytes(payload)) for _, seq, payload in records] == [(1, b"page-1"), (2, b"page-2")]
+
+
+def test_read_segments_are_collected(spool_module, tmp_path):
+    segment_spool = spool_module.SegmentSpool(str(tmp_path / "spool"), segment_size=64)
+    for index in range(4):
+        segment_spool.append(b"x" * 40 + b"%d" % index)
+    assert len(segment_spool._segments()) == 4
+
+    records = segment_spool.read("server1", max_records=3)
+    assert [seq for _, seq, _ in records] == [1, 2, 3]
+    segment_spool.ack("server1", records[-1][0])
+    segment_spool.collect_garbage(["server1", "server2"])
+    # server2 has not read anything yet
+    assert len(segment_spool._segments()) == 4
+
+    segment_spool.ack("server2", records[-1][0])
+    segment_spool.collect_garbage(["server1", "server2"])
+    assert len(segment_spool._segments()) == 2
+    assert [seq for _, seq, _ in segment_spool.read("server1")] == [4]
+    assert os.path.exists(segment_spool._segment_path(segment_spool.head()[0]))
+
+
+@pytest.fixture
+def small_spool(spool_module, segment_spool, connector, monkeypatch):
+    """Module spool of two servers that pauses collection above 1 kB."""
+    config = connector("config").ConnectorConfig.from_json(
+        {
+            "configuration": {
+                "server": [
+                    {"name": name, "server_protocol": "TCP", "server_host": "127.0.0.1", "server_port": 9}
+                    for name in ("server1", "server2")
+                ],
+                "spool_max_size_mb": 1 / 1024,
+            }
+        }
+    )
+    monkeypatch.setattr(spool_module, "get_config", lambda: config)
+    monkeypatch.setattr(spool_module, "spool", segment_spool)
+    return segment_spool
+
+
+def test_spool_full_counts_only_unread_pages(spool_module, small_spool):
+    for index in range(5):
+        small_spool.append(b"x" * 300)
+    assert spool_module.spool_full()
+
+    for destination in ("server1", "server2"):
+        small_spool.ack(destination, small_spool.read(destination)[-1][0])
+
+    # The head segment keeps the read pages until the next append
+    assert small_spool.size() > 1024
+    assert not spool_module.spool_full()
+
+
+def test_spool_full_drops_pages_of_open_servers_only(spool_module, small_spool, connector, monkeypatch):
+    circuit_breaker = connector("circuit_breaker")
+    # server1 is due for its probe, server2 is down
+    states = {"server1": circuit_breaker.HALF_OPEN, "server2": circuit_breaker.OPEN}
+    monkeypatch.setattr(spool_module, "breaker_state", states.get)
+    dropped = ("spool_dropped_bytes_total", (("server", "server2"),))
+    values = spool_module.metrics.registry._values.get()
+    dropped_before = values.get(dropped, 0)
+    for index in range(5):
+        small_spool.append(b"x" * 300)
+
+    # The half-open server keeps its pages, so collection pauses
+    assert spool_module.spool_full()
+    assert small_spool.backlog("server1") == 5 * (300 + spool_module.RECORD_HEADER.size)
+    assert small_spool.pending("server2")
+
+    small_spool.ack("server1", small_spool.read("server1")[-1][0])
+    assert not spool_module.spool_full()
+    assert not small_spool.pending("server2")
+    assert values[dropped] - dropped_before == 5 * (300 + spool_module.RECORD_HEADER.size)
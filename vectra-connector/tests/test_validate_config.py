@@ -0,0 +1,33 @@
+import socket
+import pytest
+
+
+@pytest.fixture
+def validate_config(connector, monkeypatch):
+    module = connector("validate_config")
+    breakers = {}
+    monkeypatch.setattr(module, "record_success", lambda name: breakers.update({name: True}))
+    monkeypatch.setattr(module, "record_failure", lambda name: breakers.update({name: False}))
+    return module, breakers
+
+
+def test_connectivity_test_seeds_the_breakers(validate_config):
+    module, breakers = validate_config
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    closed = socket.create_server(("127.0.0.1", 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    servers = [
+        {"name": "tcp_up", "server_protocol": "TCP", "server_host": "127.0.0.1", "server_port": port},
+        {"name": "tcp_down", "server_protocol": "TCP", "server_host": "127.0.0.1", "server_port": closed_port},
+        # No ./cert/tls_up.pem, the handshake cannot be verified
+        {"name": "tls_up", "server_protocol": "TLS", "server_host": "127.0.0.1", "server_port": port},
+        {"name": "tls_down", "server_protocol": "TLS", "server_host": "127.0.0.1", "server_port": closed_port},
+    ]
+    try:
+        module.test_connectivity_syslog({"configuration": {"server": servers}})
+    finally:
+        listener.close()
+
+    assert breakers == {"tcp_up": True, "tcp_down": False, "tls_up": False, "tls_down": False}
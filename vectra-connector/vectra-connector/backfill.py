@@ -0,0 +1,208 @@
+"""Time-sliced backfill of a stream.
+
+Run ``python -m vectra-connector.backfill <stream> --since <time>`` to pull
+a historical window in slices of ``--slice-hours``, at most ``--concurrency``
+slices at a time. Every slice pages through its own sub-checkpoint, so an
+interrupted backfill resumes where it stopped when it is started again.
+Without ``--until`` the last slice has no end time, and once every slice
+is done the highest slice checkpoint becomes the live checkpoint of the
+stream. Scheduled collection of the stream is skipped while such a
+backfill is in progress, a backfill with an end time runs next to it.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from .checkpoint import Checkpoint
+from .config import get_config
+from .dedup import get_dedup
+from .event_filter import get_event_filter
+from .logger import logger
+from .process_state import write_atomic
+from .serializer import dumps, loads
+from .tasks import BACKFILL_DIR, STREAMS, backfill_state_path
+from .vectra_api import VectraAPI
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Event timestamps have a resolution of one second
+TIME_RESOLUTION = timedelta(seconds=1)
+# Slices pulled at a time, every slice has its own checkpoint
+DEFAULT_CONCURRENCY = 4
+
+
+def slice_checkpoint(stream, index):
+    """Return the checkpoint file name of one slice."""
+    return f"{BACKFILL_DIR}/{stream}_{index}"
+
+
+def plan_slices(since, until, slice_hours):
+    """Split a window into slices.
+
+    Args:
+        since (datetime): Window start
+        until (datetime): Window end, None for an open-ended last slice
+        slice_hours (float): Length of a slice
+
+    Returns:
+        list: Slices with start, end and done
+    """
+    step = timedelta(hours=slice_hours)
+    end_of_window = until or datetime.utcnow()
+    slices = []
+    start = since
+    while True:
+        end = start + step
+        if end >= end_of_window:
+            end = until
+        slices.append(
+            {
+                "start": start.strftime(TIME_FORMAT),
+                "end": end.strftime(TIME_FORMAT) if end else None,
+                "done": False,
+            }
+        )
+        if end is None or end >= end_of_window:
+            return slices
+        start = end
+
+
+def read_state(stream):
+    with open(backfill_state_path(stream), "rb") as f:
+        return loads(f.read())
+
+
+def write_state(stream, state):
+    write_atomic(backfill_state_path(stream), dumps(state))
+
+
+def pull_slice(stream, index, time_slice, requests_per_minute):
+    """Pull the events of one slice from its sub-checkpoint.
+
+    The end of a slice is the start of the next one and is not pulled.
+
+    Args:
+        stream (str): Stream name
+        index (int): Slice number
+        time_slice (dict): Slice with start and end
+        requests_per_minute (int): Request budget of the stream
+
+    Returns:
+        bool: True if the slice was pulled to its end, False if it stopped
+            early, e.g. because the spool is full
+    """
+    spec = STREAMS[stream]
+    params = dict(spec["params"])
+    params.update({"event_timestamp_gte": time_slice["start"]})
+    if time_slice["end"]:
+        end = parse_time(time_slice["end"]) - TIME_RESOLUTION
+        params.update({"event_timestamp_lte": end.strftime(TIME_FORMAT)})
+    logger.info(
+        f"Backfilling {spec['title']} slice {index} from {time_slice['start']} "
+        f"to {time_slice['end'] or 'now'}."
+    )
+    return VectraAPI.fetch_data_from_api(
+        url=f"{str(os.environ.get('BASE_URL')).strip().strip('/')}{spec['path']}",
+        filename=slice_checkpoint(stream, index),
+        params=params,
+        requests_per_minute=requests_per_minute,
+        event_filter=get_event_filter(stream),
+        dedup=get_dedup(stream),
+        stream=stream,
+    )
+
+
+def merge(stream, state):
+    """Save the latest slice checkpoint as the live checkpoint and remove the backfill state.
+
+    Checkpoints grow with the events, so the highest one of all slices is
+    where live collection continues. A backfill with an end time leaves
+    the live checkpoint alone.
+    """
+    spec = STREAMS[stream]
+    slices = state["slices"]
+    next_checkpoint = max(
+        Checkpoint.read_checkpoint_from_file(slice_checkpoint(stream, index)) or 0
+        for index in range(len(slices))
+    )
+    if slices[-1]["end"] is None and next_checkpoint > 0:
+        Checkpoint.save_checkpoint_to_file(
+            checkpoint={f"{spec['checkpoint']}_next_checkpoint": next_checkpoint},
+            file_name=spec["checkpoint"],
+        )
+    for index in range(len(slices)):
+        Checkpoint.delete_checkpoint(slice_checkpoint(stream, index))
+    Checkpoint.flush()
+    os.remove(backfill_state_path(stream))
+    logger.info(f"Backfill of {spec['title']} is complete.")
+
+
+def backfill(stream, since=None, until=None, slice_hours=1, concurrency=DEFAULT_CONCURRENCY):
+    """Pull a window of a stream in parallel slices.
+
+    Args:
+        stream (str): Stream name, one of STREAMS
+        since (datetime): Window start, not needed to resume
+        until (datetime): Window end, not pulled, None to continue into live collection
+        slice_hours (float): Length of a slice
+        concurrency (int): Slices pulled at a time
+
+    Returns:
+        bool: True if the backfill is complete
+    """
+    settings = get_config().get("streams", {}).get(stream, {})
+    os.makedirs(BACKFILL_DIR, exist_ok=True)
+    if os.path.exists(backfill_state_path(stream)):
+        logger.info(f"Resuming backfill of '{stream}'.")
+        state = read_state(stream)
+    else:
+        if since is None:
+            logger.error("Please provide the start time of the backfill.")
+            return False
+        state = {
+            "until": until.strftime(TIME_FORMAT) if until else None,
+            "slices": plan_slices(since, until, slice_hours),
+        }
+        write_state(stream, state)
+
+    slices = state["slices"]
+    pending = [index for index, time_slice in enumerate(slices) if not time_slice["done"]]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            index: executor.submit(
+                pull_slice, stream, index, slices[index], settings.get("requests_per_minute")
+            )
+            for index in pending
+        }
+        for index, future in futures.items():
+            if future.result():
+                slices[index]["done"] = True
+                write_state(stream, state)
+
+    if not all(time_slice["done"] for time_slice in slices):
+        logger.info(f"Backfill of '{stream}' paused. Run it again to resume.")
+        return False
+    merge(stream, state)
+    return True
+
+
+def parse_time(value):
+    return datetime.strptime(value, TIME_FORMAT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill a stream in parallel time slices.")
+    parser.add_argument("stream", choices=sorted(STREAMS))
+    parser.add_argument("--since", type=parse_time, help="Window start, e.g. 2023-05-31T14:10:00Z")
+    parser.add_argument(
+        "--until", type=parse_time, help="Window end, not included, default is now and live"
+    )
+    parser.add_argument("--slice-hours", type=float, default=1)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+    if not backfill(args.stream, args.since, args.until, args.slice_hours, args.concurrency):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-task_serializer = 'json'
-result_serializer = 'json'
-accept_content = ['json']
+task_serializer = 'vectra-json'
+result_serializer = 'vectra-json'
+# 'json' is still accepted for messages queued before an upgrade
+accept_content = ['vectra-json', 'json']
 timezone = 'Asia/Kolkata'
@@ -1,63 +1,84 @@
-import json
-import os
+import atexit
+from celery.signals import worker_process_shutdown
+from .checkpoint_store import CheckpointStore
+from .config import get_config
 from .logger import logger
+from .spool import spool
+
+checkpoint_store = CheckpointStore(
+    commit_interval=get_config().get("checkpoint_commit_interval", 1)
+)
+atexit.register(checkpoint_store.flush)
+
+
+@worker_process_shutdown.connect
+def flush_checkpoints(**kwargs):
+    """Commit saved checkpoints when the worker process stops."""
+    checkpoint_store.flush()
 
 
 class Checkpoint:
-    """Checkpoint class for event collection."""
+    """Checkpoint class for event collection.
+
+    Every checkpoint is committed in the spool head first, together with
+    the spooled page that reached it or at the last sequence number for a
+    page without spooled events. It is read back from there when the
+    checkpoint store has not committed it yet, e.g. after a crash, so that
+    the page is neither lost nor pulled again.
+    """
 
     def __init__(self) -> None:
         """Initialization function"""
         pass
 
     def read_checkpoint_from_file(file_name):
-        """Read saved checkpoint from file to start collection.
+        """Read saved checkpoint to start collection.
 
         Args:
-            file_name (str): Checkpoint file name
+            file_name (str): Checkpoint name
 
         Returns:
-            int: Checkpoint value
+            int: Checkpoint value, 0 if none was saved
         """
-        checkpoint_file_path = f"./{file_name}_checkpoint.json"
-        next_checkpoint = 0
-
-        if not os.path.exists(checkpoint_file_path):
-            return 0
-        try:
-            logger.info(f"Read checkpoint from '{file_name}'.")
-            with open(checkpoint_file_path, "r") as f:
-                data = f.read()
-            data = json.loads(data)
-            next_checkpoint = data.get(f"{file_name}_next_checkpoint")
-            return next_checkpoint
-        except FileNotFoundError:
-            logger.error(
-                f"Checkpoint file for '{file_name}' was not found or file is empty."
-            )
-            logger.info(f"Starting collection from last 24 hours for '{file_name}'.")
-            return -1
-        except ValueError:
-            logger.error(
-                f"Checkpoint file for '{file_name}' is corrupted or not in correct json format."
-            )
-            logger.info(f"Creating new file for '{file_name}'.")
-            os.remove(checkpoint_file_path)
-            return -1
-        except Exception as e:
-            logger.error(f"Error while reading checkpoint: {e}")
-
-    def save_checkpoint_to_file(checkpoint, file_name):
+        logger.info(f"Read checkpoint from '{file_name}'.")
+        saved = checkpoint_store.get(file_name)
+        spooled = spool.checkpoint(file_name)
+        # The spool head is written before the store, it is never older
+        if spooled is not None and spooled != saved:
+            logger.info(f"Recovered checkpoint of '{file_name}' from the spool.")
+            checkpoint_store.set(file_name, spooled[1], seq=spooled[0])
+            saved = spooled
+        return 0 if saved is None else saved[1]
+
+    def save_checkpoint_to_file(checkpoint, file_name, seq=None):
         """Save checkpoint after collection.
 
+        The value is committed with the next group commit of the checkpoint store.
+
         Args:
             checkpoint (dict): Checkpoint value
-            file_name (str): Checkpoint file
+            file_name (str): Checkpoint name
+            seq (int): Sequence number of the spooled page that reached the
+                checkpoint, None if it was not reached through the spool
         """
-        try:
-            logger.info(f"Saving checkpoint in '{file_name}'.")
-            with open(f"./{file_name}_checkpoint.json", "w") as f:
-                f.write(json.dumps(checkpoint))
-            logger.info(f"Checkpoint saved for '{file_name}'. {checkpoint}")
-        except Exception as e:
-            logger.error(f"Error saving checkpoint. {e}")
+        value = checkpoint.get(f"{file_name}_next_checkpoint")
+        if seq is None:
+            seq = spool.record(file_name, value)
+        checkpoint_store.set(file_name, value, seq=seq)
+        logger.info(f"Checkpoint saved for '{file_name}'. {checkpoint}")
+
+    def has_checkpoint(file_name):
+        """Return True if a checkpoint was saved under the name."""
+        return (
+            checkpoint_store.get(file_name) is not None
+            or spool.checkpoint(file_name) is not None
+        )
+
+    def delete_checkpoint(file_name):
+        """Remove a saved checkpoint."""
+        spool.forget(file_name)
+        checkpoint_store.delete(file_name)
+
+    def flush():
+        """Commit saved checkpoints so that other processes read them."""
+        checkpoint_store.flush()
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+from .logger import logger
+from .process_state import ProcessLocal
+from .serializer import loads
+
+CHECKPOINT_DB_PATH = "./checkpoints.db"
+
+
+class CheckpointStore:
+    """Checkpoints of all streams in one SQLite database in WAL mode.
+
+    Saved values are kept in memory and committed together by a background
+    thread every ``commit_interval`` seconds, so a page costs no disk write.
+    A value saved by this process is authoritative until it is committed;
+    other values are read from the database, so the next run of a stream
+    sees the checkpoint of whichever process ran it last. Checkpoints of the
+    former ``./<name>_checkpoint.json`` files are imported on first read.
+    """
+
+    def __init__(self, path=CHECKPOINT_DB_PATH, commit_interval=1) -> None:
+        """Initialization function
+
+        Args:
+            path (str): Database path
+            commit_interval (float): Seconds between group commits, 0 commits every save
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flusher = None
+        # Connections and the flusher thread do not survive a fork
+        self._connection = ProcessLocal(self._open)
+
+    def _open(self):
+        self._pending = {}
+        self._flusher = None
+        connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=FULL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints "
+            "(name TEXT PRIMARY KEY, value, seq INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(checkpoints)")]
+        if "seq" not in columns:
+            connection.execute("ALTER TABLE checkpoints ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        return connection
+
+    def _connect(self):
+        return self._connection.get()
+
+    def get(self, name):
+        """Return the checkpoint of a stream.
+
+        Args:
+            name (str): Checkpoint name
+
+        Returns:
+            tuple: (sequence number, checkpoint), None if the stream has none
+        """
+        with self._lock:
+            connection = self._connect()
+            if name in self._pending:
+                return self._pending[name]
+            row = connection.execute(
+                "SELECT seq, value FROM checkpoints WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None:
+                return row
+            value = self._read_legacy(name)
+            if value is None:
+                return None
+            connection.execute(
+                "INSERT OR REPLACE INTO checkpoints (name, value, seq) VALUES (?, ?, 0)",
+                (name, value),
+            )
+            os.remove(f"./{name}_checkpoint.json")
+            logger.info(f"Moved checkpoint of '{name}' to the checkpoint store.")
+            return (0, value)
+
+    def set(self, name, value, seq=0):
+        """Save the checkpoint of a stream, committed with the next group commit.
+
+        Args:
+            name (str): Checkpoint name
+            value: Checkpoint value
+            seq (int): Spool sequence number of the page that reached the checkpoint
+        """
+        with self._lock:
+            self._connect()
+            self._pending[name] = (seq, value)
+            if self.commit_interval <= 0:
+                self._commit()
+            elif self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                self._flusher.start()
+
+    def delete(self, name):
+        """Remove the checkpoint of a stream."""
+        with self._lock:
+            self._pending.pop(name, None)
+            self._connect().execute("DELETE FROM checkpoints WHERE name = ?", (name,))
+
+    def flush(self):
+        """Commit every saved checkpoint of this process now."""
+        with self._lock:
+            if self._connection.built():
+                self._commit()
+
+    def _commit(self):
+        if not self._pending:
+            return
+        connection = self._connection.get()
+        try:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO checkpoints (name, seq, value) VALUES (?, ?, ?)",
+                    [(name, seq, value) for name, (seq, value) in self._pending.items()],
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error saving checkpoint. {e}")
+            return
+        self._pending.clear()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.commit_interval)
+            self.flush()
+
+    @staticmethod
+    def _read_legacy(name):
+        try:
+            with open(f"./{name}_checkpoint.json", "rb") as f:
+                return loads(f.read()).get(f"{name}_next_checkpoint")
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.error(
+                f"Checkpoint file for '{name}' is corrupted or not in correct json format."
+            )
+            return None
@@ -0,0 +1,129 @@
+"""Circuit breakers of the syslog servers shared by all processes.
+
+A breaker is closed while its server accepts events. After a failed
+delivery it opens and sends are skipped until the probe time, doubled
+after every failed probe. Once that time has passed the breaker is
+half-open and the next probe or push decides whether it closes again.
+The state lives in a small JSON file replaced atomically under a lock,
+and readers only re-parse it when its stat signature changes.
+"""
+import json
+import os
+import time
+from .logger import logger
+from .process_state import update_json
+
+BREAKER_FILE_PATH = "./circuit_breaker.json"
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+MIN_PROBE_INTERVAL = 15
+MAX_PROBE_INTERVAL = 300
+
+_cache = {"signature": None, "breakers": {}}
+
+
+def read_breakers(path=BREAKER_FILE_PATH):
+    """Return the stored breaker of every server, re-reading the file only when it changed.
+
+    Args:
+        path (str): Breaker file path
+
+    Returns:
+        dict: Breaker by server name
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if signature != _cache["signature"]:
+        try:
+            with open(path, "r") as f:
+                _cache["breakers"] = json.load(f)
+        except ValueError:
+            logger.error(f"File '{path}' is corrupted or not in correct json format.")
+            return _cache["breakers"]
+        _cache["signature"] = signature
+    return _cache["breakers"]
+
+
+def breaker_state(server_name, path=BREAKER_FILE_PATH):
+    """Return the current state of a server's breaker.
+
+    Args:
+        server_name (str): Destination server name
+        path (str): Breaker file path
+
+    Returns:
+        str: CLOSED, OPEN or HALF_OPEN
+    """
+    breaker = read_breakers(path).get(server_name)
+    if breaker is None or breaker["state"] == CLOSED:
+        return CLOSED
+    return OPEN if time.time() < breaker["probe_at"] else HALF_OPEN
+
+
+def allow_request(server_name, path=BREAKER_FILE_PATH):
+    """Return True if events may be sent to the server."""
+    return breaker_state(server_name, path) != OPEN
+
+
+def probe_interval(failures):
+    """Return the wait before probing a server that failed the given number of times."""
+    return min(MIN_PROBE_INTERVAL * 2 ** max(failures - 1, 0), MAX_PROBE_INTERVAL)
+
+
+def _update(server_name, update, path):
+    def apply(breakers):
+        breaker = update(breakers.get(server_name))
+        if breaker is not None:
+            breakers[server_name] = breaker
+        return breaker
+
+    return update_json(path, apply)
+
+
+def record_success(server_name, path=BREAKER_FILE_PATH):
+    """Close the breaker of a server that accepted a connection or events.
+
+    Args:
+        server_name (str): Destination server name
+        path (str): Breaker file path
+    """
+    if breaker_state(server_name, path) == CLOSED:
+        return
+
+    def close(breaker):
+        if breaker is None or breaker["state"] == CLOSED:
+            return None
+        return {"state": CLOSED, "failures": 0, "probe_at": 0}
+
+    if _update(server_name, close, path) is not None:
+        logger.info(f"Server '{server_name}' is reachable.")
+
+
+def record_failure(server_name, path=BREAKER_FILE_PATH):
+    """Open the breaker of a server that could not be reached.
+
+    Failures reported while the breaker is already open, e.g. by
+    several processes at startup, are counted once.
+
+    Args:
+        server_name (str): Destination server name
+        path (str): Breaker file path
+    """
+
+    def trip(breaker):
+        now = time.time()
+        if breaker is not None and breaker["state"] == OPEN and now < breaker["probe_at"]:
+            return None
+        failures = breaker["failures"] + 1 if breaker is not None else 1
+        return {"state": OPEN, "failures": failures, "probe_at": now + probe_interval(failures)}
+
+    breaker = _update(server_name, trip, path)
+    if breaker is not None:
+        logger.error(
+            f"Server '{server_name}' is unreachable. "
+            f"Next probe in {probe_interval(breaker['failures'])} seconds."
+        )
@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+import jsonschema
+from .logger import logger
+from .syslog_writer import NON_TRANSPARENT, RFC3164
+from .validate_config import configSchema
+
+CONFIG_FILE_PATH = "./config.json"
+
+
+def _freeze(value):
+    """Return a read-only copy of parsed JSON data."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    """Resolved settings of one syslog destination."""
+
+    index: int
+    name: str
+    protocol: str
+    host: str
+    port: int
+    certs: str
+    syslog_format: str
+    framing: str
+    retry_count: int = None
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    @classmethod
+    def from_json(cls, index, server):
+        name = str(server.get("name")).strip()
+        protocol = str(server.get("server_protocol")).strip().upper()
+        return cls(
+            index=index,
+            name=name,
+            protocol=protocol,
+            host=str(server.get("server_host")).strip(),
+            port=int(server.get("server_port")),
+            certs=f"./cert/{name}.pem" if protocol == "TLS" else None,
+            syslog_format=server.get("syslog_format", RFC3164),
+            framing=server.get("framing", NON_TRANSPARENT),
+            retry_count=server.get("retry_count"),
+        )
+
+
+@dataclass(frozen=True)
+class ConnectorConfig:
+    """Immutable view of config.json."""
+
+    configuration: MappingProxyType
+    servers: tuple
+
+    def get(self, key, default=None):
+        """Return a value of the 'configuration' section."""
+        return self.configuration.get(key, default)
+
+    @property
+    def retry_count(self):
+        return self.configuration.get("retry_count")
+
+    @property
+    def scheduler(self):
+        return self.configuration.get("scheduler")
+
+    @classmethod
+    def from_json(cls, conf_data):
+        configuration = _freeze(conf_data.get("configuration"))
+        return cls(
+            configuration=configuration,
+            servers=tuple(
+                ServerConfig.from_json(index, server)
+                for index, server in enumerate(configuration.get("server"))
+            ),
+        )
+
+
+class ConfigLoader:
+    """Load config.json once per process and reload it when the file changes."""
+
+    def __init__(self, path=CONFIG_FILE_PATH) -> None:
+        """Initialization function
+
+        Args:
+            path (str): Config file path
+        """
+        self.path = path
+        self._config = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current config, reloading it if the file was replaced or modified.
+
+        Returns:
+            ConnectorConfig: Current config
+        """
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            if self._config is None:
+                logger.error(f"File 'config.json' not found: {e}")
+                sys.exit()
+            return self._config
+        if signature == self._signature:
+            return self._config
+
+        with self._lock:
+            if signature != self._signature:
+                self._load(signature)
+        return self._config
+
+    def _load(self, signature):
+        logger.info("Reading 'config.json'.")
+        try:
+            with open(self.path, "r") as f:
+                conf_data = json.load(f)
+            jsonschema.validate(instance=conf_data, schema=configSchema)
+            config = ConnectorConfig.from_json(conf_data)
+        except (ValueError, jsonschema.exceptions.ValidationError) as e:
+            if self._config is None:
+                logger.error(f"File 'config.json' is not valid: {e}")
+                sys.exit()
+            logger.error(f"Changed 'config.json' is not valid, keeping previous config: {e}")
+            self._signature = signature
+            return
+        self._config = config
+        self._signature = signature
+
+
+config_loader = ConfigLoader()
+
+
+def get_config():
+    """Return the cached config of this process.
+
+    Returns:
+        ConnectorConfig: Current config
+    """
+    return config_loader.get()
@@ -0,0 +1,126 @@
+import select
+import socket
+import ssl
+import threading
+import time
+from . import metrics
+from .logger import logger
+from .process_state import ProcessLocal
+from .syslog_writer import SyslogWriter
+
+
+class SyslogConnectionPool:
+    """Per-worker pool of open syslog connections keyed by server name."""
+
+    def __init__(self, idle_timeout=300, max_batch_size=65536) -> None:
+        """Initialization function
+
+        Args:
+            idle_timeout (int): Seconds after which an unused connection is closed
+            max_batch_size (int): Bytes buffered before each batched socket write
+        """
+        self.idle_timeout = idle_timeout
+        self.max_batch_size = max_batch_size
+        # Sockets inherited from the parent process must not be shared
+        self._local = ProcessLocal(dict)
+        self._lock = threading.Lock()
+
+    @property
+    def _connections(self):
+        return self._local.get()
+
+    def get_writer(self, server):
+        """Return a connected writer for the server, reconnecting if needed.
+
+        Args:
+            server (ServerConfig): Destination server
+
+        Returns:
+            SyslogWriter: Connected syslog writer
+        """
+        with self._lock:
+            self._close_idle()
+            entry = self._connections.get(server.name)
+            if entry is not None:
+                writer, writer_server, _ = entry
+                if writer_server == server and self._is_alive(writer):
+                    self._connections[server.name] = (writer, server, time.monotonic())
+                    return writer
+                logger.info(f"Connection to '{server.name}' is stale. Reconnecting.")
+                self._close(server.name)
+
+            logger.info(f"Connecting {server.protocol} server '{server.name}'.")
+            writer = SyslogWriter(
+                server.protocol,
+                server.address,
+                certs=server.certs,
+                message_format=server.syslog_format,
+                framing=server.framing,
+                max_batch_size=self.max_batch_size,
+            )
+            self._connections[server.name] = (writer, server, time.monotonic())
+            metrics.inc("syslog_connects_total", server=server.name)
+            return writer
+
+    def discard(self, server_name):
+        """Close and forget the connection of a server after a send failure.
+
+        Args:
+            server_name (str): Destination server name
+        """
+        with self._lock:
+            self._close(server_name)
+
+    def close_all(self):
+        """Close every pooled connection."""
+        with self._lock:
+            for server_name in list(self._connections):
+                self._close(server_name)
+
+    def _close_idle(self):
+        if self.idle_timeout is None or self.idle_timeout <= 0:
+            return
+        now = time.monotonic()
+        for server_name, (_, _, last_used) in list(self._connections.items()):
+            if now - last_used > self.idle_timeout:
+                logger.info(f"Closing idle connection to '{server_name}'.")
+                self._close(server_name)
+
+    def _close(self, server_name):
+        entry = self._connections.pop(server_name, None)
+        if entry is None:
+            return
+        try:
+            entry[0].close()
+        except Exception as e:
+            logger.error(f"Error while closing connection to '{server_name}': {e}")
+
+    @staticmethod
+    def _is_alive(writer):
+        """Check that a pooled stream connection was not closed by the server.
+
+        Syslog servers never send data back, so a readable stream socket
+        means the peer closed the connection or reset it, unless it only
+        holds TLS records such as session tickets.
+        """
+        if writer.socktype == socket.SOCK_DGRAM:
+            return True
+        try:
+            if writer.socket.fileno() < 0:
+                return False
+            readable, _, _ = select.select([writer.socket], [], [], 0)
+            if not readable:
+                return True
+            if not isinstance(writer.socket, ssl.SSLSocket):
+                return False
+            # TLS 1.3 servers send session tickets after the handshake
+            timeout = writer.socket.gettimeout()
+            writer.socket.settimeout(0)
+            try:
+                return writer.socket.recv(1) != b""
+            except ssl.SSLWantReadError:
+                return True
+            finally:
+                writer.socket.settimeout(timeout)
+        except (OSError, ValueError):
+            return False
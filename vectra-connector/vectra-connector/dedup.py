@@ -0,0 +1,230 @@
+"""Deduplication of re-emitted events.
+
+The 'dedup' settings of a stream in config.json name the fields that
+identify an event, e.g. ``["id"]`` or ``["id", "urgency_score",
+"threat_score"]`` for entity scores. Every identity is kept as an 8-byte
+hash in a SQLite table shared by all worker processes for ``ttl``
+seconds, at most ``max_entries`` per stream. Events whose identity was
+forwarded within the TTL are dropped before spooling.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from .config import get_config
+from .event_filter import compile_accessor
+from .logger import logger
+from .process_state import ProcessLocal
+from .serializer import dumps
+
+DEDUP_DB_PATH = "./dedup.db"
+# Identities per SQL statement, below the SQLite variable limit
+QUERY_CHUNK = 500
+
+
+class DedupCache:
+    """Identity hashes of forwarded events with their expiry time."""
+
+    def __init__(self, path=DEDUP_DB_PATH) -> None:
+        """Initialization function
+
+        Args:
+            path (str): Database path
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # Connections do not survive a fork
+        self._connection = ProcessLocal(self._open)
+
+    def _open(self):
+        connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS seen (stream TEXT, key INTEGER, expires REAL, "
+            "PRIMARY KEY (stream, key)) WITHOUT ROWID"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS seen_expires ON seen (stream, expires)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS stats (stream TEXT PRIMARY KEY, "
+            "hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)"
+        )
+        return connection
+
+    def _connect(self):
+        return self._connection.get()
+
+    def seen(self, stream, keys):
+        """Return the keys that were remembered and have not expired.
+
+        Args:
+            stream (str): Stream name
+            keys (list): Identity hashes
+
+        Returns:
+            set: Known keys
+        """
+        known = set()
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            for start in range(0, len(keys), QUERY_CHUNK):
+                chunk = keys[start:start + QUERY_CHUNK]
+                known.update(
+                    row[0]
+                    for row in connection.execute(
+                        "SELECT key FROM seen WHERE stream = ? AND expires > ? "
+                        f"AND key IN ({','.join('?' * len(chunk))})",
+                        (stream, now, *chunk),
+                    )
+                )
+        return known
+
+    def remember(self, stream, keys, ttl, max_entries, hits=0):
+        """Remember forwarded keys and count the hits and misses of a page.
+
+        Args:
+            stream (str): Stream name
+            keys (list): Identity hashes of the forwarded events
+            ttl (float): Seconds a key is remembered
+            max_entries (int): Keys kept per stream, the oldest are evicted first
+            hits (int): Duplicates dropped from the page
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO seen (stream, key, expires) VALUES (?, ?, ?)",
+                    [(stream, key, now + ttl) for key in keys],
+                )
+                connection.execute(
+                    "INSERT INTO stats (stream, hits, misses) VALUES (?, ?, ?) "
+                    "ON CONFLICT (stream) DO UPDATE SET hits = hits + excluded.hits, "
+                    "misses = misses + excluded.misses",
+                    (stream, hits, len(keys)),
+                )
+                connection.execute(
+                    "DELETE FROM seen WHERE stream = ? AND expires <= ?", (stream, now)
+                )
+                (entries,) = connection.execute(
+                    "SELECT COUNT(*) FROM seen WHERE stream = ?", (stream,)
+                ).fetchone()
+                if entries > max_entries:
+                    connection.execute(
+                        "DELETE FROM seen WHERE stream = ? AND key IN (SELECT key FROM seen "
+                        "WHERE stream = ? ORDER BY expires LIMIT ?)",
+                        (stream, stream, entries - max_entries),
+                    )
+
+    def stats(self, stream):
+        """Return the hits, misses and remembered keys of a stream.
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT hits, misses FROM stats WHERE stream = ?", (stream,)
+            ).fetchone()
+            (entries,) = connection.execute(
+                "SELECT COUNT(*) FROM seen WHERE stream = ? AND expires > ?",
+                (stream, time.time()),
+            ).fetchone()
+        hits, misses = row or (0, 0)
+        return {"hits": hits, "misses": misses, "entries": entries}
+
+
+dedup_cache = DedupCache()
+
+
+class StreamDedup:
+    """Deduplication settings of one stream."""
+
+    def __init__(self, stream, fields, ttl=3600, max_entries=100000, cache=dedup_cache) -> None:
+        """Initialization function
+
+        Args:
+            stream (str): Stream name
+            fields (list): Fields identifying an event
+            ttl (float): Seconds an identity is remembered
+            max_entries (int): Identities remembered for the stream
+            cache (DedupCache): Shared cache
+        """
+        self.stream = stream
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = cache
+        self._accessors = [compile_accessor(field) for field in fields]
+
+    def key(self, event):
+        """Return the identity hash of an event as a signed 64-bit integer.
+
+        An event without any of the key fields has no identity and returns
+        None, it is never dropped or remembered.
+        """
+        values = [get(event) for get in self._accessors]
+        if all(value is None for value in values):
+            return None
+        identity = dumps(values)
+        return int.from_bytes(
+            hashlib.blake2b(identity, digest_size=8).digest(), "big", signed=True
+        )
+
+    def drop_seen(self, events, keys):
+        """Drop events already forwarded within the TTL or repeated in the page.
+
+        Args:
+            events (list): Events of a page
+            keys (list): Identity hashes of the events, None for events without identity
+
+        Returns:
+            tuple: Remaining events, their keys and the number of dropped events
+        """
+        known = self.cache.seen(self.stream, [key for key in keys if key is not None])
+        kept_events, kept_keys = [], []
+        for event, key in zip(events, keys):
+            if key is not None:
+                if key in known:
+                    continue
+                known.add(key)
+            kept_events.append(event)
+            kept_keys.append(key)
+        dropped = len(events) - len(kept_events)
+        if dropped:
+            logger.info(f"Dropped {dropped} duplicate events of '{self.stream}'.")
+        return kept_events, kept_keys, dropped
+
+    def remember(self, keys, hits=0):
+        """Remember the keys of spooled events, skipping events without identity."""
+        keys = [key for key in keys if key is not None]
+        self.cache.remember(self.stream, keys, self.ttl, self.max_entries, hits=hits)
+
+    def stats(self):
+        return self.cache.stats(self.stream)
+
+
+_streams = {}
+
+
+def get_dedup(stream):
+    """Return the deduplication of a stream, None if it is not configured."""
+    config = get_config()
+    cached = _streams.get(stream)
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    spec = config.get("streams", {}).get(stream, {}).get("dedup")
+    dedup = None
+    if spec:
+        dedup = StreamDedup(
+            stream,
+            spec["key"],
+            ttl=spec.get("ttl", 3600),
+            max_entries=spec.get("max_entries", 100000),
+        )
+    _streams[stream] = (config, dedup)
+    return dedup
@@ -0,0 +1,325 @@
+"""Asyncio engine running collection and forwarding in one process.
+
+Start with ``python -m vectra-connector.engine`` when config.json sets
+``"engine": "asyncio"``. The stream collectors append pages to the spool
+like the Celery tasks do and wake up one writer per server, which reads
+the spool from its own position instead of through the Celery broker. A
+writer whose server's circuit breaker is open leaves its pages in the
+spool until the breaker lets it try again, so a down server does not
+hold back the others.
+"""
+import asyncio
+import os
+import ssl
+import time
+from .celery import cron_scheduler_dict
+from . import vectra_api
+from .checkpoint import Checkpoint
+from .circuit_breaker import allow_request, record_failure, record_success
+from . import metrics
+from .config import get_config
+from .dedup import get_dedup
+from .event_filter import filter_events, filter_keyed_events, get_event_filter
+from .fetch_control import get_fetch_controller, retry_after
+from .logger import logger
+from .profiling import install_profiler
+from .serializer import loads
+from .spool import join_events, split_events, spool, spool_full
+from .syslog_writer import build_header, encode_event, iter_batches
+from .tasks import STREAMS, stream_params
+
+# Seconds between two checks of an open circuit breaker
+BREAKER_POLL_INTERVAL = 1
+
+
+class StreamCollector:
+    """Collect one stream on its cron schedule."""
+
+    def __init__(self, stream, schedule, writers) -> None:
+        """Initialization function
+
+        Args:
+            stream (str): Stream name, one of STREAMS
+            schedule (crontab): Celery cron schedule of the stream
+            writers (list): Server writers woken up after a page was spooled
+        """
+        self.stream = stream
+        self.spec = STREAMS[stream]
+        self.schedule = schedule
+        self.writers = writers
+        self.url = f"{str(os.environ.get('BASE_URL')).strip().strip('/')}{self.spec['path']}"
+
+    async def run(self):
+        last_run_at = self.schedule.now()
+        while True:
+            is_due, next_time_to_check = self.schedule.is_due(last_run_at)
+            if not is_due:
+                await asyncio.sleep(next_time_to_check)
+                continue
+            last_run_at = self.schedule.now()
+            try:
+                await self.collect()
+            except Exception as e:
+                logger.error(f"An exception occurred while collecting '{self.stream}': {e}")
+
+    async def _get(self, params):
+        return await asyncio.to_thread(
+            vectra_api.api_session().get,
+            self.url,
+            auth=vectra_api.bearer_auth,
+            params=dict(params),
+        )
+
+    async def collect(self):
+        """Pull pages from the stream checkpoint until no events remain."""
+        logger.info(f"Executing {self.spec['title']} API task.")
+        settings = get_config().get("streams", {}).get(self.stream, {})
+        requests_per_minute = settings.get("requests_per_minute")
+        filename = self.spec["checkpoint"]
+        params = stream_params(self.stream)
+        controller = get_fetch_controller(self.url, get_config())
+        next_checkpoint = Checkpoint.read_checkpoint_from_file(filename)
+        try:
+            await self.pull(filename, params, next_checkpoint, controller, requests_per_minute)
+        finally:
+            Checkpoint.flush()
+            logger.info(f"Fetch control of '{filename}': {controller.snapshot()}")
+
+    async def pull(self, filename, params, next_checkpoint, controller, requests_per_minute):
+        auth_retries = 0
+        while True:
+            await asyncio.sleep(controller.reserve())
+            params.update({"from": next_checkpoint, "limit": controller.page_size()})
+            logger.info(f"Started Events Collection for '{filename}'.")
+            req = await self._get(params)
+            if req.status_code == 401 and auth_retries < 3:
+                auth_retries += 1
+                logger.error(f"Status-code {req.status_code} Exception {req.text}")
+                vectra_api.access_token = await asyncio.to_thread(
+                    vectra_api.Auth.auth_token_using_refresh_token
+                )
+                continue
+            if req.status_code == 429:
+                # The next reserve waits for Retry-After
+                controller.record_throttle(retry_after(req))
+                metrics.inc("api_throttled_total", endpoint=controller.endpoint)
+                continue
+            req.raise_for_status()
+            auth_retries = 0
+            controller.record_response(req.elapsed.total_seconds(), len(req.content))
+            metrics.observe(
+                "api_request_seconds", req.elapsed.total_seconds(), endpoint=controller.endpoint
+            )
+            body = await asyncio.to_thread(loads, req.content)
+            if not body.get("events"):
+                logger.info(f"No new events for '{filename}'.")
+                return
+            logger.info(f"Events collected for '{filename}'.")
+            metrics.inc("events_fetched_total", len(body["events"]), stream=self.stream)
+            newest_event = metrics.parse_timestamp(body["events"][-1].get("event_timestamp"))
+            if newest_event is not None:
+                metrics.set_max("newest_event_timestamp_seconds", newest_event, stream=self.stream)
+            event_filter = get_event_filter(self.stream)
+            dedup = get_dedup(self.stream)
+            keys, duplicates = (), 0
+            if dedup is None:
+                events = filter_events(body["events"], event_filter)
+            else:
+                events, keys = filter_keyed_events(body["events"], event_filter, dedup.key)
+                if events:
+                    events, keys, duplicates = await asyncio.to_thread(dedup.drop_seen, events, keys)
+            seq = None
+            if events:
+                if await asyncio.to_thread(spool_full):
+                    logger.info(
+                        f"Spool is full. Pausing collection for '{filename}' until servers catch up."
+                    )
+                    return
+                # Encode once, every writer sends the same spooled page.
+                # The page and its checkpoint are committed together.
+                payload = join_events([encode_event(event) for event in events])
+                seq = await asyncio.to_thread(
+                    spool.append, payload, checkpoint=(filename, body.get("next_checkpoint"))
+                )
+                metrics.inc("events_spooled_total", len(events), stream=self.stream)
+                if dedup is not None:
+                    # Remembered once spooled, a crash before can only re-send
+                    await asyncio.to_thread(dedup.remember, keys, hits=duplicates)
+            elif duplicates:
+                await asyncio.to_thread(dedup.remember, [], hits=duplicates)
+            Checkpoint.save_checkpoint_to_file(
+                checkpoint={f"{filename}_next_checkpoint": body.get("next_checkpoint")},
+                file_name=filename,
+                seq=seq,
+            )
+            if seq is not None:
+                for writer in self.writers:
+                    writer.wakeup.set()
+            if body.get("remaining_count") == 0:
+                return
+            next_checkpoint = body.get("next_checkpoint")
+            if requests_per_minute:
+                await asyncio.sleep(60 / requests_per_minute)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def error_received(self, exc):
+        logger.error(f"Connection error: {exc}")
+
+
+class AsyncSyslogWriter:
+    """Forward the spooled pages of one syslog server."""
+
+    def __init__(self, server, max_tries, max_batch_size=65536) -> None:
+        """Initialization function
+
+        Args:
+            server (ServerConfig): Destination server
+            max_tries (int): Send attempts per page before the breaker of the server opens
+            max_batch_size (int): Bytes per stream write
+        """
+        self.server = server
+        # Set by the collectors after a page was spooled, pages left from
+        # before the start are sent first
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        self.max_tries = max_tries
+        self.max_batch_size = max_batch_size
+        self.priority = b"<14>"
+        self.reader = None
+        self.writer = None
+        self.transport = None
+
+    async def connect(self):
+        server = self.server
+        logger.info(f"Connecting {server.protocol} server '{server.name}'.")
+        metrics.inc("syslog_connects_total", server=server.name)
+        if server.protocol == "UDP":
+            loop = asyncio.get_running_loop()
+            self.transport, _ = await loop.create_datagram_endpoint(
+                _DatagramProtocol, remote_addr=server.address
+            )
+            return
+        context = None
+        if server.protocol == "TLS":
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_REQUIRED
+            context.load_verify_locations(cafile=server.certs)
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(server.host, server.port, ssl=context), 60
+        )
+        logger.info(f"Server '{server.name}' is connected.")
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.transport is not None:
+            self.transport.close()
+        self.reader = self.writer = self.transport = None
+
+    async def send(self, events):
+        header = build_header(self.priority, self.server.syslog_format)
+        if self.server.protocol == "UDP":
+            if self.transport is None:
+                await self.connect()
+            for event in events:
+                self.transport.sendto(header + event + b"\n")
+            return
+        # Syslog servers never send data, EOF means the server closed the connection
+        if self.writer is None or self.reader.at_eof():
+            self.close()
+            await self.connect()
+        for buffer in iter_batches(events, header, self.server.framing, self.max_batch_size):
+            self.writer.write(buffer)
+            await self.writer.drain()
+
+    async def drain(self):
+        """Send the unread spooled pages of the server."""
+        name = self.server.name
+        pages = 0
+        last_seq = None
+        while True:
+            records = await asyncio.to_thread(spool.read, name)
+            if not records:
+                break
+            for position, seq, payload in records:
+                events = split_events(payload)
+                started = time.perf_counter()
+                await self.send(events)
+                metrics.observe("push_seconds", time.perf_counter() - started, server=name)
+                metrics.inc("push_events_total", len(events), server=name)
+                metrics.inc("push_bytes_total", len(payload), server=name)
+                # High-water mark, a restart resends only later pages
+                await asyncio.to_thread(spool.ack, name, position)
+                last_seq = seq
+                pages += 1
+        if pages:
+            logger.info(f"Events pushed to '{name}'. Pages: {pages}. Last page: {last_seq}.")
+        spool.collect_garbage([server.name for server in get_config().servers])
+
+    async def deliver(self):
+        """Send the unread spooled pages once the breaker of the server allows it.
+
+        Returns:
+            bool: True if the pages were sent, False if the breaker opened
+        """
+        name = self.server.name
+        while not allow_request(name):
+            await asyncio.sleep(BREAKER_POLL_INTERVAL)
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                await self.drain()
+                record_success(name)
+                return True
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.error(f"Connection error: {str(e)}")
+                metrics.inc("push_errors_total", server=name)
+                self.close()
+                if attempt < self.max_tries:
+                    logger.info("Retrying.")
+                    await asyncio.sleep(min(2 ** attempt, 60))
+        record_failure(name)
+        return False
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            # The pages stay in the spool until the server accepts them
+            while not await self.deliver():
+                pass
+
+
+async def run_engine():
+    """Run all stream collectors and server writers until stopped."""
+    config = get_config()
+    writers = []
+    for server in config.servers:
+        retry_count = config.retry_count if server.retry_count is None else server.retry_count
+        writers.append(
+            AsyncSyslogWriter(
+                server,
+                retry_count if retry_count in range(1, 11) else 10,
+                max_batch_size=config.get("max_batch_size", 65536),
+            )
+        )
+    collectors = [
+        StreamCollector(stream, cron_scheduler_dict.get(spec["schedule"]), writers)
+        for stream, spec in STREAMS.items()
+    ]
+    logger.info("Starting asyncio engine.")
+    await asyncio.gather(
+        *(writer.run() for writer in writers),
+        *(collector.run() for collector in collectors),
+    )
+
+
+def main():
+    metrics.start_metrics_server(get_config().get("metrics_port", 9108))
+    install_profiler()
+    asyncio.run(run_engine())
+
+
+if __name__ == "__main__":
+    main()
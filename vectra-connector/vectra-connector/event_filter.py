@@ -0,0 +1,148 @@
+"""Per-stream event filtering and field projection.
+
+The 'filter' of a stream in config.json is compiled once into a function
+that returns the trimmed event, or None if the event is dropped:
+
+    "filter": {
+        "conditions": [{"field": "urgency_score", "operator": "gte", "value": 50}],
+        "fields": ["id", "name", "urgency_score", "last_detection.type"]
+    }
+
+Every condition must match. Dotted names address nested fields.
+"""
+import operator
+from .config import get_config
+
+OPERATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": lambda field, value: field in value,
+    "not_in": lambda field, value: field not in value,
+}
+
+
+def compile_accessor(field):
+    """Return a function reading a possibly nested field, None if it is missing."""
+    keys = field.split(".")
+    if len(keys) == 1:
+        return operator.methodcaller("get", field)
+
+    def get(event):
+        for key in keys:
+            if not isinstance(event, dict):
+                return None
+            event = event.get(key)
+        return event
+
+    return get
+
+
+def compile_condition(condition):
+    get = compile_accessor(condition["field"])
+    compare = OPERATORS[condition["operator"]]
+    value = condition["value"]
+    # Only membership tests take a list of values, eq and ne compare list fields as they are
+    if condition["operator"] in ("in", "not_in") and isinstance(value, (list, tuple)):
+        value = frozenset(value) if all(isinstance(item, str) for item in value) else tuple(value)
+
+    def matches(event):
+        try:
+            return compare(get(event), value)
+        except TypeError:
+            # e.g. a missing field compared with a score threshold
+            return False
+
+    return matches
+
+
+def compile_projection(fields):
+    if all("." not in field for field in fields):
+        fields = tuple(fields)
+        return lambda event: {field: event[field] for field in fields if field in event}
+    paths = [field.split(".") for field in fields]
+
+    def project(event):
+        result = {}
+        for path in paths:
+            source, target = event, result
+            for key in path[:-1]:
+                source = source.get(key) if isinstance(source, dict) else None
+                if not isinstance(source, dict):
+                    break
+                target = target.setdefault(key, {})
+            else:
+                if path[-1] in source:
+                    target[path[-1]] = source[path[-1]]
+        return result
+
+    return project
+
+
+def compile_filter(spec):
+    """Compile the filter of a stream.
+
+    Args:
+        spec (dict): 'filter' settings of the stream
+
+    Returns:
+        function: Returns the projected event, or None if the event is dropped
+    """
+    conditions = [compile_condition(condition) for condition in spec.get("conditions", ())]
+    project = compile_projection(spec["fields"]) if spec.get("fields") else None
+
+    def event_filter(event):
+        for matches in conditions:
+            if not matches(event):
+                return None
+        return project(event) if project is not None else event
+
+    return event_filter
+
+
+_compiled = {}
+
+
+def get_event_filter(stream):
+    """Return the compiled filter of a stream, None if it has none.
+
+    The filter is compiled again only after config.json changed.
+    """
+    config = get_config()
+    cached = _compiled.get(stream)
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    spec = config.get("streams", {}).get(stream, {}).get("filter")
+    event_filter = compile_filter(spec) if spec else None
+    _compiled[stream] = (config, event_filter)
+    return event_filter
+
+
+def filter_events(events, event_filter):
+    """Apply a compiled filter to the events of a page."""
+    if event_filter is None:
+        return events
+    return [event for event in map(event_filter, events) if event is not None]
+
+
+def filter_keyed_events(events, event_filter, event_key):
+    """Apply a compiled filter to the events of a page and key the kept events.
+
+    Args:
+        events (list): Events of a page
+        event_filter (function): Compiled filter, None to keep every event
+        event_key (function): Identity of an event, computed before the projection
+
+    Returns:
+        tuple: Kept events and their identity keys, in page order
+    """
+    kept_events, keys = [], []
+    for event in events:
+        kept = event if event_filter is None else event_filter(event)
+        if kept is not None:
+            kept_events.append(kept)
+            keys.append(event_key(event))
+    return kept_events, keys
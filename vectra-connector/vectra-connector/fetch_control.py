@@ -0,0 +1,187 @@
+"""Adaptive page size and request pacing for the Vectra API.
+
+All streams use one API credential, so they share a single request budget.
+The budget is a token bucket kept as a theoretical arrival time in a small
+JSON file under a lock, which lets every worker process reserve the next
+request slot. A 429 halves the request rate and blocks the bucket for the
+Retry-After time, every successful response raises the rate again by one
+request per minute. The page size of each endpoint shrinks when responses
+get slow or large and grows back while they are fast.
+"""
+import time
+from urllib.parse import urlparse
+from .logger import logger
+from .process_state import update_json
+
+CONTROL_FILE_PATH = "./fetch_control.json"
+MIN_REQUESTS_PER_MINUTE = 6
+MIN_PAGE_SIZE = 100
+BURST = 5
+TARGET_LATENCY = 10
+MAX_PAGE_BYTES = 32 * 1024 * 1024
+# Weight of the newest response in the latency and size averages
+SMOOTHING = 0.3
+
+
+class FetchController:
+    """Request budget of the API credential and page size of one endpoint."""
+
+    def __init__(
+        self,
+        endpoint,
+        max_requests_per_minute=300,
+        max_page_size=1000,
+        path=CONTROL_FILE_PATH,
+    ) -> None:
+        """Initialization function
+
+        Args:
+            endpoint (str): Endpoint key, e.g. the URL path
+            max_requests_per_minute (float): Highest request rate of the credential
+            max_page_size (int): Highest number of events per page
+            path (str): Shared state file path
+        """
+        self.endpoint = endpoint
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_page_size = max_page_size
+        self.path = path
+
+    def _update(self, update):
+        def apply(state):
+            bucket = state.setdefault(
+                "bucket",
+                {
+                    "requests_per_minute": self.max_requests_per_minute,
+                    "tat": 0,
+                    "blocked_until": 0,
+                    "throttled": 0,
+                },
+            )
+            bucket["requests_per_minute"] = min(
+                bucket["requests_per_minute"], self.max_requests_per_minute
+            )
+            endpoint = state.setdefault("endpoints", {}).setdefault(
+                self.endpoint,
+                {"page_size": self.max_page_size, "latency": 0, "page_bytes": 0, "pages": 0},
+            )
+            endpoint["page_size"] = min(endpoint["page_size"], self.max_page_size)
+            return update(bucket, endpoint, time.time())
+
+        # Pacing adapts again to the next responses, it does not need to survive a crash
+        return update_json(self.path, apply, durable=False)
+
+    def reserve(self):
+        """Reserve the next request slot of the shared budget.
+
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+
+        def take(bucket, endpoint, now):
+            interval = 60 / bucket["requests_per_minute"]
+            start = max(now, bucket["blocked_until"], bucket["tat"] - BURST * interval)
+            bucket["tat"] = max(bucket["tat"], start) + interval
+            return start - now
+
+        return self._update(take)
+
+    def page_size(self):
+        """Return the number of events to request in the next page."""
+        return self._update(lambda bucket, endpoint, now: endpoint["page_size"])
+
+    def record_response(self, latency, size):
+        """Adapt the page size and request rate to a successful response.
+
+        Args:
+            latency (float): Seconds until the response was received
+            size (int): Response body size in bytes
+        """
+
+        def learn(bucket, endpoint, now):
+            if endpoint["pages"]:
+                endpoint["latency"] += SMOOTHING * (latency - endpoint["latency"])
+                endpoint["page_bytes"] += SMOOTHING * (size - endpoint["page_bytes"])
+            else:
+                endpoint["latency"], endpoint["page_bytes"] = latency, size
+            endpoint["pages"] += 1
+            page_size = endpoint["page_size"]
+            if endpoint["latency"] > TARGET_LATENCY or endpoint["page_bytes"] > MAX_PAGE_BYTES:
+                page_size = max(MIN_PAGE_SIZE, page_size // 2)
+            elif endpoint["latency"] < TARGET_LATENCY / 2:
+                page_size = min(self.max_page_size, page_size + page_size // 4)
+            if page_size != endpoint["page_size"]:
+                logger.info(
+                    f"Page size of '{self.endpoint}' changed from {endpoint['page_size']} to {page_size}."
+                )
+                endpoint["page_size"] = page_size
+            bucket["requests_per_minute"] = min(
+                self.max_requests_per_minute, bucket["requests_per_minute"] + 1
+            )
+
+        self._update(learn)
+
+    def record_throttle(self, retry_after):
+        """Slow down after the API answered 429.
+
+        Args:
+            retry_after (float): Seconds from the Retry-After header
+        """
+
+        def throttle(bucket, endpoint, now):
+            bucket["requests_per_minute"] = max(
+                MIN_REQUESTS_PER_MINUTE, bucket["requests_per_minute"] / 2
+            )
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + retry_after)
+            bucket["throttled"] += 1
+            return bucket["requests_per_minute"]
+
+        requests_per_minute = self._update(throttle)
+        logger.info(
+            f"Too many requests. Pausing API requests for {retry_after} seconds, "
+            f"then sending {requests_per_minute:.1f} requests per minute."
+        )
+
+    def snapshot(self):
+        """Return the shared request budget and the state of this endpoint.
+
+        Returns:
+            dict: Controller state
+        """
+
+        def read(bucket, endpoint, now):
+            return {
+                "requests_per_minute": bucket["requests_per_minute"],
+                "blocked_seconds": max(0, bucket["blocked_until"] - now),
+                "throttled": bucket["throttled"],
+                "page_size": endpoint["page_size"],
+                "latency": endpoint["latency"],
+                "page_bytes": endpoint["page_bytes"],
+                "pages": endpoint["pages"],
+            }
+
+        return self._update(read)
+
+
+def get_fetch_controller(url, config):
+    """Return the controller of an endpoint with limits from config.json.
+
+    Args:
+        url (str): Endpoint URL
+        config (ConnectorConfig): Current config
+
+    Returns:
+        FetchController: Controller of the endpoint
+    """
+    return FetchController(
+        urlparse(url).path,
+        max_requests_per_minute=config.get("api_requests_per_minute", 300),
+        max_page_size=config.get("page_size", 1000),
+    )
+
+
+def retry_after(response, default=10):
+    """Return the Retry-After seconds of a response."""
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        return default
@@ -0,0 +1,45 @@
+import requests
+from requests.adapters import HTTPAdapter
+from .process_state import ProcessLocal
+
+
+class BearerAuth(requests.auth.AuthBase):
+    """Inject the current access token into every request."""
+
+    def __init__(self, token_getter) -> None:
+        """Initialization function
+
+        Args:
+            token_getter (callable): Returns the current access token
+        """
+        self.token_getter = token_getter
+
+    def __call__(self, request):
+        request.headers["Authorization"] = f"Bearer {self.token_getter()}"
+        return request
+
+
+def _new_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+_session = ProcessLocal(_new_session)
+
+
+def get_session(pool_size=10):
+    """Return the keep-alive HTTP session of this process.
+
+    Sessions are not shared with forked worker processes.
+
+    Args:
+        pool_size (int): Connections kept open per host
+
+    Returns:
+        requests.Session: Shared session
+    """
+    return _session.get(pool_size)
@@ -0,0 +1,32 @@
+"""Per-server delivery lanes.
+
+Every configured server gets its own Celery queue, consumed by a
+dedicated worker started from run_docker.sh, so retries and outages of
+one server never hold worker slots of the others. Whether a lane sends
+at all is decided by the server's circuit breaker. Running this module
+prints the lane queue names.
+"""
+from .config import get_config
+
+LANE_QUEUE_PREFIX = "syslog."
+
+
+def lane_queue(server):
+    """Return the Celery queue of a server's delivery lane.
+
+    Args:
+        server (ServerConfig): Destination server
+
+    Returns:
+        str: Queue name
+    """
+    return f"{LANE_QUEUE_PREFIX}{server.name}"
+
+
+def main():
+    for server in get_config().servers:
+        print(lane_queue(server))
+
+
+if __name__ == "__main__":
+    main()
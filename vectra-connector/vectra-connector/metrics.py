@@ -0,0 +1,349 @@
+"""Prometheus metrics of the connector.
+
+Every process counts into its own registry, which a background thread
+writes to ``./metrics/<pid>.json`` every few seconds. The first process
+that binds ``metrics_port`` serves ``/metrics``: the counters and
+histograms of all processes summed up, plus the state the processes
+already share through files, i.e. circuit breakers, fetch control,
+deduplication, spool backlog and broker queue depth.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .logger import logger
+from .process_state import ProcessLocal, write_atomic
+from .serializer import dumps
+
+METRICS_DIR = "./metrics"
+WRITE_INTERVAL = 5
+PREFIX = "vectra_connector_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "events_fetched_total": ("counter", "Events received from the Vectra API.", None),
+    "events_spooled_total": ("counter", "Events spooled after filtering and deduplication.", None),
+    "api_request_seconds": ("histogram", "Vectra API page request latency.", LATENCY_BUCKETS),
+    "api_throttled_total": ("counter", "Vectra API responses with status 429.", None),
+    "pages_per_run": ("histogram", "Pages fetched per collection run.", PAGE_BUCKETS),
+    "newest_event_timestamp_seconds": ("gauge", "Timestamp of the newest fetched event.", None),
+    "push_seconds": ("histogram", "Time to send one page to a syslog server.", LATENCY_BUCKETS),
+    "push_bytes_total": ("counter", "Event bytes sent to a syslog server.", None),
+    "push_events_total": ("counter", "Events sent to a syslog server.", None),
+    "push_errors_total": ("counter", "Failed attempts to send to a syslog server.", None),
+    "syslog_connects_total": ("counter", "Connections opened to a syslog server.", None),
+    "spool_dropped_bytes_total": ("counter", "Spooled bytes dropped for a down server.", None),
+    "stage_seconds_total": ("counter", "Seconds spent in a stage of collection or push runs.", None),
+}
+
+
+class Registry:
+    """Metrics recorded by this process."""
+
+    def __init__(self, directory=METRICS_DIR) -> None:
+        """Initialization function
+
+        Args:
+            directory (str): Folder of the per-process metric files
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        # Values of the parent are not counted again by forked children
+        self._values = ProcessLocal(self._start)
+
+    def _start(self):
+        threading.Thread(target=self._run_writer, daemon=True).start()
+        return {}
+
+    def _entry(self, name, labels, default):
+        values = self._values.get()
+        key = (name, tuple(sorted(labels.items())))
+        if key not in values:
+            values[key] = default()
+        return values, key
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter."""
+        with self._lock:
+            values, key = self._entry(name, labels, float)
+            values[key] += value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        buckets = METRICS[name][2]
+        with self._lock:
+            values, key = self._entry(name, labels, lambda: [0] * (len(buckets) + 2))
+            counts = values[key]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+
+    def set_max(self, name, value, **labels):
+        """Raise a gauge to a value."""
+        with self._lock:
+            values, key = self._entry(name, labels, float)
+            values[key] = max(values[key], value)
+
+    def write(self):
+        """Write the metrics of this process to its file."""
+        with self._lock:
+            if not self._values.built():
+                return
+            values = [
+                [name, dict(labels), value] for (name, labels), value in self._values.get().items()
+            ]
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            # Rewritten every few seconds, a crash loses no more than that
+            write_atomic(
+                os.path.join(self.directory, f"{os.getpid()}.json"), dumps(values), durable=False
+            )
+        except OSError as e:
+            logger.error(f"Error writing metrics. {e}")
+
+    def _run_writer(self):
+        while True:
+            time.sleep(WRITE_INTERVAL)
+            self.write()
+
+
+registry = Registry()
+atexit.register(registry.write)
+inc = registry.inc
+observe = registry.observe
+set_max = registry.set_max
+
+
+def parse_timestamp(value):
+    """Return the epoch seconds of a Vectra timestamp, None if it is not one."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def collect_files(directory=METRICS_DIR):
+    """Sum the metric files of all processes.
+
+    Returns:
+        dict: (name, labels) to value
+    """
+    totals = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path, "r") as f:
+                values = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in values:
+            if name not in METRICS:
+                continue
+            key = (name, tuple(sorted(labels.items())))
+            kind = METRICS[name][0]
+            if key not in totals:
+                totals[key] = value
+            elif kind == "histogram":
+                totals[key] = [a + b for a, b in zip(totals[key], value)]
+            elif kind == "gauge":
+                totals[key] = max(totals[key], value)
+            else:
+                totals[key] += value
+    return totals
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def render_files(totals):
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (key, labels), value in totals.items() if key == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for labels, value in series:
+            if kind != "histogram":
+                lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), value):
+                cumulative += count
+                lines.append(
+                    f"{PREFIX}{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}"
+                )
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {value[-1]}")
+    return lines
+
+
+def gauge(lines, name, help_text, series, kind="gauge"):
+    """Append a gauge of (labels, value) pairs to the exposition."""
+    lines.append(f"# HELP {PREFIX}{name} {help_text}")
+    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+    for labels, value in series:
+        lines.append(f"{PREFIX}{name}{format_labels(tuple(labels.items()))} {value}")
+
+
+def render_shared_state(lines, totals, app=None):
+    """Append the state shared through files and the broker."""
+    # Imported here, the modules that record metrics are imported by these
+    from .circuit_breaker import CLOSED, HALF_OPEN, breaker_state
+    from .config import get_config
+    from .dedup import get_dedup
+    from .fetch_control import CONTROL_FILE_PATH
+    from .lanes import lane_queue
+    from .spool import spool
+
+    now = time.time()
+    config = get_config()
+    servers = config.servers
+    gauge(
+        lines,
+        "checkpoint_lag_seconds",
+        "Seconds since the timestamp of the newest fetched event.",
+        [
+            (dict(labels), max(0, now - value))
+            for (name, labels), value in sorted(totals.items())
+            if name == "newest_event_timestamp_seconds"
+        ],
+    )
+    states = {CLOSED: 0, HALF_OPEN: 1}
+    gauge(
+        lines,
+        "circuit_breaker_state",
+        "Circuit breaker of a server, 0 closed, 1 half-open, 2 open.",
+        [({"server": server.name}, states.get(breaker_state(server.name), 2)) for server in servers],
+    )
+    gauge(lines, "spool_bytes", "Size of the spool.", [({}, spool.size())])
+    gauge(
+        lines,
+        "spool_backlog_bytes",
+        "Spooled bytes a server has not received yet.",
+        [({"server": server.name}, spool.backlog(server.name)) for server in servers],
+    )
+    try:
+        with open(CONTROL_FILE_PATH, "r") as f:
+            control = json.load(f)
+    except (FileNotFoundError, ValueError):
+        control = {}
+    if control:
+        bucket = control["bucket"]
+        gauge(
+            lines,
+            "api_requests_per_minute",
+            "Current Vectra API request rate of the fetch controller.",
+            [({}, bucket["requests_per_minute"])],
+        )
+        gauge(
+            lines,
+            "api_page_size",
+            "Current page size of a Vectra API endpoint.",
+            [
+                ({"endpoint": endpoint}, state["page_size"])
+                for endpoint, state in sorted(control["endpoints"].items())
+            ],
+        )
+    dedup_stats = [
+        (stream, dedup.stats())
+        for stream, dedup in ((stream, get_dedup(stream)) for stream in config.get("streams", {}))
+        if dedup is not None
+    ]
+    for field, name, help_text, kind in (
+        ("hits", "dedup_hits_total", "Duplicate events dropped.", "counter"),
+        ("misses", "dedup_misses_total", "Events forwarded by the deduplication.", "counter"),
+        ("entries", "dedup_entries", "Identities remembered by the deduplication.", "gauge"),
+    ):
+        if dedup_stats:
+            gauge(
+                lines,
+                name,
+                help_text,
+                [({"stream": stream}, stats[field]) for stream, stats in dedup_stats],
+                kind=kind,
+            )
+    if app is not None:
+        depths = []
+        try:
+            with app.connection_for_read() as connection:
+                channel = connection.default_channel
+                for queue in ["celery"] + [lane_queue(server) for server in servers]:
+                    try:
+                        declared = channel.queue_declare(queue, passive=True)
+                        depths.append(({"queue": queue}, declared.message_count))
+                    except Exception:
+                        # The queue does not exist until its worker starts
+                        channel = connection.channel()
+        except Exception as e:
+            logger.error(f"Error reading broker queue depth. {e}")
+        gauge(lines, "queue_depth", "Messages waiting in a broker queue.", depths)
+
+
+def render(app=None):
+    """Return the metrics exposition of all processes."""
+    registry.write()
+    totals = collect_files()
+    lines = render_files(totals)
+    try:
+        render_shared_state(lines, totals, app)
+    except Exception as e:
+        logger.error(f"Error collecting metrics. {e}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port, app=None):
+    """Serve /metrics from this process unless another process already does.
+
+    Args:
+        port (int): TCP port, 0 disables the endpoint
+        app (Celery): Application whose broker queues are reported
+
+    Returns:
+        ThreadingHTTPServer: The server, None if it was not started
+    """
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render(app).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    except OSError:
+        logger.info(f"Metrics on port {port} are served by another process.")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on port {port}.")
+    return server
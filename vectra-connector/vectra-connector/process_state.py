@@ -0,0 +1,93 @@
+"""State files shared by the connector processes and state kept per process.
+
+A state file is replaced atomically: the new content is written to a
+temporary file of the writing process and renamed over the old one, so a
+reader sees either the old or the new state. Durable writes are fsynced
+before the rename and survive a crash of the host. ``update_json`` reads,
+changes and replaces a JSON state file under an exclusive lock file.
+
+Connections, threads and buffers of a process must not be used by the
+worker processes Celery forks from it. ``ProcessLocal`` builds them again
+the first time they are used in a new process.
+"""
+import fcntl
+import os
+import threading
+from .serializer import dumps, loads
+
+
+def write_atomic(path, data, durable=True):
+    """Replace a file with new content.
+
+    Args:
+        path (str): File path
+        data (bytes): New content
+        durable (bool): fsync the content before it replaces the file
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def update_json(path, update, durable=True):
+    """Read, change and replace a JSON state file under its lock.
+
+    The file is only replaced when the update changed the state.
+
+    Args:
+        path (str): State file path, locked through '<path>.lock'
+        update (function): Changes the state dict in place and returns a result
+        durable (bool): fsync the new state before it replaces the file
+
+    Returns:
+        Result of the update
+    """
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            state = loads(data)
+        except (FileNotFoundError, ValueError):
+            data, state = None, {}
+        result = update(state)
+        new_data = dumps(state)
+        if new_data != data:
+            write_atomic(path, new_data, durable=durable)
+    return result
+
+
+class ProcessLocal:
+    """A value that belongs to the process that built it."""
+
+    def __init__(self, factory) -> None:
+        """Initialization function
+
+        Args:
+            factory (function): Builds the value of a process
+        """
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._value = None
+
+    def get(self, *args):
+        """Return the value of this process, building it on first use after a fork.
+
+        Args:
+            args: Arguments of the factory when it builds the value
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory(*args)
+                    self._pid = os.getpid()
+        return self._value
+
+    def built(self):
+        """Return True if this process built its value."""
+        return self._pid == os.getpid()
@@ -0,0 +1,179 @@
+"""Stage timers and an on-demand sampling profiler.
+
+A ``StageTimer`` adds up the time a collection or push run spends in each
+stage and logs one summary line per run. The per-stage seconds are also
+counted in the stage_seconds_total metric.
+
+The sampling profiler records the stacks of all threads of a process
+every ``SAMPLE_INTERVAL`` seconds and writes them to
+``./profiles/<pid>.folded`` in the collapsed format read by
+flamegraph.pl and speedscope. It starts with the process when the
+VECTRA_PROFILE environment variable is 1, and ``kill -USR2 <pid>``
+starts or stops it in a running process.
+"""
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from . import metrics
+from .logger import logger
+from .process_state import write_atomic
+
+PROFILE_DIR = "./profiles"
+SAMPLE_INTERVAL = 0.01
+# Seconds between two writes of the collapsed stacks while profiling
+DUMP_INTERVAL = 60
+
+
+class StageTimer:
+    """Time spent in the stages of one run."""
+
+    def __init__(self, task, name) -> None:
+        """Initialization function
+
+        Args:
+            task (str): Kind of run, e.g. fetch or push
+            name (str): Stream or server of the run
+        """
+        self.task = task
+        self.name = name
+        self.totals = {}
+        self.counts = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the enclosed block as one call of a stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage, seconds):
+        """Add the duration of one call of a stage."""
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def summary(self):
+        """Return the stages with their total seconds and calls."""
+        with self._lock:
+            stages = ", ".join(
+                f"{stage} {seconds:.3f}s/{self.counts[stage]}"
+                for stage, seconds in self.totals.items()
+            )
+        return f"{stages}, run {time.perf_counter() - self.started:.3f}s"
+
+    def log(self):
+        """Log the summary and count the stage seconds in the metrics."""
+        if not self.totals:
+            return
+        logger.info(f"Stages of {self.task} '{self.name}': {self.summary()}")
+        for stage, seconds in self.totals.items():
+            metrics.inc("stage_seconds_total", seconds, task=self.task, stage=stage)
+
+
+class SamplingProfiler:
+    """Collapsed stacks of every thread of this process."""
+
+    def __init__(self, directory=PROFILE_DIR, interval=SAMPLE_INTERVAL) -> None:
+        """Initialization function
+
+        Args:
+            directory (str): Folder of the collapsed stack files
+            interval (float): Seconds between two samples
+        """
+        self.directory = directory
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks = Counter()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started in process {os.getpid()}.")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.dump()
+        logger.info(f"Sampling profiler stopped. Stacks written to '{self.path}'.")
+
+    def toggle(self, *args):
+        """Start the profiler, or stop it and write the stacks. Used as signal handler."""
+        # Joining the sampler from a signal handler could deadlock on the log lock
+        threading.Thread(target=self.stop if self.running else self.start).start()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{os.getpid()}.folded")
+
+    def dump(self):
+        """Write the collapsed stacks sampled since the profiler started."""
+        stacks = list(self.stacks.items())
+        os.makedirs(self.directory, exist_ok=True)
+        data = "".join(f"{stack} {count}\n" for stack, count in stacks).encode()
+        write_atomic(self.path, data, durable=False)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        labels = {}
+        last_dump = time.monotonic()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = (
+                            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                        )
+                    frames.append(label)
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                frames.append(names.get(thread_id, "thread"))
+                self.stacks[";".join(reversed(frames))] += 1
+            if time.monotonic() - last_dump > DUMP_INTERVAL:
+                self.dump()
+                last_dump = time.monotonic()
+
+
+profiler = SamplingProfiler()
+
+
+def install_profiler():
+    """Start the profiler if VECTRA_PROFILE is 1 and toggle it on SIGUSR2.
+
+    Must be called from the main thread of the process.
+    """
+    signal.signal(signal.SIGUSR2, profiler.toggle)
+    if os.environ.get("VECTRA_PROFILE") == "1":
+        profiler.start()
+
+
+@atexit.register
+def _dump_on_exit():
+    if profiler.running:
+        profiler.dump()
@@ -1,146 +1,164 @@
-import json
 import socket
-import backoff
-import sys
-import os
-import signal
-import logging
-import datetime
-from .syslog_handler import SSLSysLogHandler
+import time
+from celery.signals import worker_process_shutdown
+from . import metrics
+from .connection_pool import SyslogConnectionPool
+from .circuit_breaker import (
+    HALF_OPEN,
+    allow_request,
+    breaker_state,
+    record_failure,
+    record_success,
+)
+from .lanes import lane_queue
+from .profiling import StageTimer
+from .spool import spool, split_events
+from .syslog_writer import SyslogWriter, encode_event
 from .celery import app
 from .logger import logger
-from .validate_config import read_config
+from .config import get_config
+
+PROBE_TIMEOUT = 10
 
 # Reading Config file
-conf_data = read_config()
+conf_data = get_config()
 
-logger.info("Reading 'server_status.json' for check server status.")
-with open("./server_status.json", "r") as f:
-    server_status = json.load(f)
+# Connections are kept open across tasks of this worker process
+connection_pool = SyslogConnectionPool(
+    idle_timeout=conf_data.get("connection_idle_timeout", 300),
+    max_batch_size=conf_data.get("max_batch_size", 65536),
+)
 
 
-def kill_process_and_exit(e):
-    """
-    Exit the current execution
-    """
-    logger.error("Exiting current proccess.")
-    os.kill(os.getpid(), signal.SIGTERM)
-    sys.exit()
+@worker_process_shutdown.connect
+def close_syslog_connections(**kwargs):
+    """Close pooled syslog connections when the worker process stops."""
+    connection_pool.close_all()
 
 
 @app.task
-@backoff.on_exception(
-    backoff.expo,
-    socket.error,
-    max_tries=conf_data.get("configuration").get("retry_count")
-    if conf_data.get("configuration").get("retry_count") in range(0, 11)
-    else 10,
-    on_giveup=kill_process_and_exit,
-)
-def push_data_to_syslog(data, server=0):
-    """Celery task for push events to configured server."""
-    conf_data = read_config()
-    server_host = str(
-        conf_data.get("configuration").get("server")[server].get("server_host")
-    ).strip()
-    server_port = int(
-        conf_data.get("configuration").get("server")[server].get("server_port")
-    )
-    server_name = str(conf_data.get("configuration").get("server")[server].get("name"))
-    server_protocol = str(
-        conf_data.get("configuration").get("server")[server].get("server_protocol")
-    ).strip()
-    logger.info(f"Push data to '{server_name}' server.")
-    syslogger = logging.getLogger()
-    syslogger.setLevel(logging.INFO)
-    syslogger.handlers = []
-    syslogger.propagate = False
-
-    if server_protocol.upper() == "TLS" and server_status.get(server_name):
-        try:
-            tls_certificate_path = f"./cert/{server_name}.pem"
-
-            # Connect to the TLS server
-            logger.info(f"Connecting {server_protocol} server '{server_name}'.")
-            tls_handler = SSLSysLogHandler(
-                transform_data=data,
-                protocol=server_protocol,
-                address=(
-                    server_host,
-                    server_port,
-                ),
-                certs=tls_certificate_path
-            )
-            host_name = 'VECTRA-SYSLOG-CONNECTOR'
-            time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-            formatter = logging.Formatter(f'{time} ' + f'{host_name}: ' + '%(message)s\n')
-            tls_handler.setFormatter(formatter)
-            tls_handler.append_nul = False
-            syslogger.addHandler(tls_handler)
-            logger.info(f"Server '{server_name}' is connected.")
-            for data in data['events']:
-                syslogger.info(
-                        json.dumps(data) if isinstance(data, dict) else data
-                    )
-                syslogger.handlers[0].flush()
-            tls_handler.close()
-            logger.info(f"Events pushed to '{server_name}'.")
+def push_data_to_syslog(data=None, server=0):
+    """Celery task for push events to configured server.
+
+    Runs in the delivery lane of the server and sends the pages of the
+    spool the server has not received yet. A server whose circuit
+    breaker is open is skipped without a connection attempt; its pages
+    stay in the spool until the health probe closes the breaker.
+
+    Args:
+        data (dict): Events of a message queued before the spool was used
+        server (int): Index of the server in config.json
+    """
+    conf_data = get_config()
+    server = conf_data.servers[server]
+    if not allow_request(server.name):
+        logger.info(f"Server '{server.name}' is unavailable. Keeping its events in the spool.")
+        return
+    retry_count = conf_data.retry_count if server.retry_count is None else server.retry_count
+    max_tries = retry_count if retry_count in range(1, 11) else 10
+    logger.info(f"Push data to '{server.name}' server.")
+    timer = StageTimer("push", server.name)
 
+    for attempt in range(1, max_tries + 1):
+        try:
+            if data is not None:
+                writer = connection_pool.get_writer(server)
+                writer.write_events(
+                    [encode_event(event) for event in data['events']], writer.header()
+                )
+                data = None
+            drain_spool(server, timer)
+            record_success(server.name)
+            timer.log()
+            return
         except socket.error as e:
             logger.error(f"Connection error: {str(e)}")
-            if conf_data.get("configuration").get("retry_count") < 0:
-                logger.info("Retry count is less than 0. Retrying continuously.")
-                push_data_to_syslog.apply_async(args=[data, server])
-            else:
+            metrics.inc("push_errors_total", server=server.name)
+            connection_pool.discard(server.name)
+            if attempt < max_tries:
                 logger.info("Retrying.")
-                raise socket.error from e
+                time.sleep(min(2 ** attempt, 60))
         except Exception as e:
             logger.error(f"An error occurred: {str(e)}")
+            return
 
-    elif server_status.get(server_name):
-        # Set UDP socket by default
-        socket_type = socket.SOCK_DGRAM
-        if server_protocol.upper() == "TCP":
-            # Set TCP socket
-            socket_type = socket.SOCK_STREAM
+    timer.log()
+    record_failure(server.name)
 
-        try:
-            syslogger = logging.getLogger()
-            syslogger.setLevel(logging.INFO)
-            syslogger.handlers = []
-            syslogger.propagate = False
-            handler = SSLSysLogHandler(
-                data,
-                server_protocol,
-                address=(
-                    server_host,
-                    server_port,
-                ),
-                socktype=socket_type,
-            )
-            host_name = 'VECTRA-SYSLOG-CONNECTOR'
-            time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-            formatter = logging.Formatter(f'{time} ' + f'{host_name}: ' + '%(message)s\n')
-            handler.setFormatter(formatter)
-            handler.append_nul = False
-            syslogger.addHandler(handler)
-            logger.info(f"Server '{server_name}' is connected.")
-            for data in data['events']:
-                syslogger.info(
-                        json.dumps(data) if isinstance(data, dict) else data
-                    )
-                syslogger.handlers[0].flush()
-            handler.close()
-
-            logger.info(f"Events pushed to '{server_name}'.")
 
+@app.task
+def probe_servers():
+    """Celery task for probing servers whose circuit breaker is not closed.
+
+    A half-open server that accepts a connection is closed again and its
+    lane is asked to send the events kept in the spool. A server that
+    still refuses stays open for twice as long as before.
+    """
+    for server in get_config().servers:
+        if breaker_state(server.name) != HALF_OPEN:
+            continue
+        logger.info(f"Probing server '{server.name}'.")
+        try:
+            SyslogWriter(
+                server.protocol,
+                server.address,
+                certs=server.certs,
+                timeout=PROBE_TIMEOUT,
+            ).close()
         except socket.error as e:
             logger.error(f"Connection error: {str(e)}")
-            if conf_data.get("configuration").get("retry_count") < 0:
-                logger.info("Retry count is less than 0. Retrying continuously.")
-                push_data_to_syslog.apply_async(args=[data, server])
-            else:
-                logger.info("Retrying.")
-                raise socket.error from e
-        except Exception as e:
-            logger.error(f"An error occurred: {str(e)}")
+            record_failure(server.name)
+            continue
+        record_success(server.name)
+        push_data_to_syslog.apply_async(args=[None, server.index], queue=lane_queue(server))
+
+
+def drain_spool(server, timer=None):
+    """Send the unread spooled pages of a server.
+
+    Only one process drains a server at a time. A process that finds the
+    server busy leaves the pages to the current consumer, which checks
+    for pages appended while it was releasing the server.
+
+    Args:
+        server (ServerConfig): Destination server
+        timer (StageTimer): Timer of the push run
+    """
+    if timer is None:
+        timer = StageTimer("push", server.name)
+    while True:
+        with spool.consumer(server.name) as acquired:
+            if not acquired:
+                return
+            pages = 0
+            last_seq = None
+            while True:
+                with timer.stage("read"):
+                    records = spool.read(server.name)
+                if not records:
+                    break
+                with timer.stage("connect"):
+                    writer = connection_pool.get_writer(server)
+                logger.info(f"Server '{server.name}' is connected.")
+                header = writer.header()
+                for position, seq, payload in records:
+                    started = time.perf_counter()
+                    events = split_events(payload)
+                    writer.write_events(events, header)
+                    elapsed = time.perf_counter() - started
+                    timer.add("send", elapsed)
+                    metrics.observe("push_seconds", elapsed, server=server.name)
+                    metrics.inc("push_bytes_total", len(payload), server=server.name)
+                    metrics.inc("push_events_total", len(events), server=server.name)
+                    # High-water mark, a restart resends only later pages
+                    with timer.stage("ack"):
+                        spool.ack(server.name, position)
+                    last_seq = seq
+                    pages += 1
+            if pages:
+                logger.info(
+                    f"Events pushed to '{server.name}'. Pages: {pages}. Last page: {last_seq}."
+                )
+            spool.collect_garbage([configured.name for configured in get_config().servers])
+        if not spool.pending(server.name):
+            return
@@ -0,0 +1,60 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+KOMBU_SERIALIZER = "vectra-json"
+KOMBU_CONTENT_TYPE = "application/x-vectra-json"
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(data):
+    """Serialize data to compact JSON bytes with the fastest installed backend.
+
+    Args:
+        data: JSON serializable data
+
+    Returns:
+        bytes: Encoded JSON
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Values orjson rejects, e.g. integers wider than 64 bits
+            pass
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def loads(data):
+    """Parse JSON from bytes or str with the fastest installed backend.
+
+    Args:
+        data (bytes): Encoded JSON
+
+    Returns:
+        Parsed data
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Input orjson rejects, e.g. integers wider than 64 bits
+            pass
+    return json.loads(data)
+
+
+def register_kombu_serializer():
+    """Register the serializer for Celery task messages as 'vectra-json'."""
+    from kombu.serialization import register
+
+    register(
+        KOMBU_SERIALIZER,
+        dumps,
+        loads,
+        content_type=KOMBU_CONTENT_TYPE,
+        content_encoding="binary",
+    )
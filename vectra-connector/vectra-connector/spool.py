@@ -0,0 +1,323 @@
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from . import metrics
+from .config import get_config
+from .logger import logger
+from .process_state import write_atomic
+from .serializer import dumps, loads
+from .circuit_breaker import OPEN, breaker_state
+
+SPOOL_DIR = "./spool"
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Every record is a 4-byte big-endian length and an 8-byte sequence number
+# followed by the page payload
+RECORD_HEADER = struct.Struct("!IQ")
+
+
+class SegmentSpool:
+    """Durable append-only spool between collection and delivery.
+
+    Pages are appended to segment files under a process lock and fsynced.
+    Every page gets the next sequence number. The 'head' file holds the
+    committed end of the newest segment, the last sequence number and the
+    collection checkpoint reached by each stream's last page, so a page and
+    its checkpoint are committed together. A torn write after a crash is
+    cut off before the next append. Every
+    destination has its own read position in 'offsets/<name>' and reads
+    segments through mmap. Segments every destination has read are deleted.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_size=SEGMENT_SIZE) -> None:
+        """Initialization function
+
+        Args:
+            directory (str): Spool directory
+            segment_size (int): Bytes after which a new segment is started
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments_dir = os.path.join(directory, "segments")
+        self.offsets_dir = os.path.join(directory, "offsets")
+        self.locks_dir = os.path.join(directory, "locks")
+        for path in (self.segments_dir, self.offsets_dir, self.locks_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.segments_dir, f"{segment:020d}.seg")
+
+    def _segments(self):
+        return sorted(
+            int(name[:-4]) for name in os.listdir(self.segments_dir) if name.endswith(".seg")
+        )
+
+    @staticmethod
+    def _read_position(path):
+        try:
+            with open(path, "r") as f:
+                segment, offset = f.read().split()
+            return int(segment), int(offset)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_position(path, position):
+        write_atomic(path, f"{position[0]} {position[1]}".encode())
+
+    def _read_head(self):
+        try:
+            with open(os.path.join(self.directory, "head"), "rb") as f:
+                return loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return {"segment": 1, "offset": 0, "seq": 0, "checkpoints": {}}
+
+    def _write_head(self, head):
+        write_atomic(os.path.join(self.directory, "head"), dumps(head))
+
+    def head(self):
+        """Return the committed end of the spool as (segment, offset)."""
+        head = self._read_head()
+        return head["segment"], head["offset"]
+
+    def checkpoint(self, name):
+        """Return the last spooled checkpoint of a stream.
+
+        Args:
+            name (str): Checkpoint name
+
+        Returns:
+            tuple: (sequence number, checkpoint), None if no page of the stream was spooled
+        """
+        checkpoint = self._read_head()["checkpoints"].get(name)
+        return tuple(checkpoint) if checkpoint is not None else None
+
+    def record(self, name, value):
+        """Commit a checkpoint reached without a spooled page, e.g. after a filtered page.
+
+        Args:
+            name (str): Checkpoint name
+            value: Checkpoint value
+
+        Returns:
+            int: Sequence number of the last spooled page
+        """
+        with self._lock("append"):
+            head = self._read_head()
+            head["checkpoints"][name] = [head["seq"], value]
+            self._write_head(head)
+        return head["seq"]
+
+    def forget(self, name):
+        """Remove the spooled checkpoint of a stream."""
+        with self._lock("append"):
+            head = self._read_head()
+            if head["checkpoints"].pop(name, None) is not None:
+                self._write_head(head)
+
+    @contextmanager
+    def _lock(self, name, blocking=True):
+        lock_file = open(os.path.join(self.locks_dir, f"{name}.lock"), "w")
+        try:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
+    def append(self, payload, checkpoint=None):
+        """Durably append one page.
+
+        Args:
+            payload (bytes): Encoded page
+            checkpoint (tuple): (checkpoint name, value) reached with this page
+
+        Returns:
+            int: Sequence number of the page
+        """
+        with self._lock("append"):
+            head = self._read_head()
+            segment, end = head["segment"], head["offset"]
+            if end and end + RECORD_HEADER.size + len(payload) > self.segment_size:
+                os.truncate(self._segment_path(segment), end)
+                segment, end = segment + 1, 0
+            seq = head["seq"] + 1
+            with open(self._segment_path(segment), "ab") as f:
+                # Drop a torn record left by a crash before the head was updated
+                f.truncate(end)
+                f.write(RECORD_HEADER.pack(len(payload), seq))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            head.update(
+                {"segment": segment, "offset": end + RECORD_HEADER.size + len(payload), "seq": seq}
+            )
+            if checkpoint is not None:
+                name, value = checkpoint
+                head["checkpoints"][name] = [seq, value]
+            self._write_head(head)
+        return seq
+
+    def position(self, destination):
+        """Return the read position of a destination.
+
+        A destination without a saved position starts at the oldest segment.
+        """
+        position = self._read_position(os.path.join(self.offsets_dir, destination))
+        if position is None:
+            segments = self._segments()
+            position = (segments[0] if segments else self.head()[0], 0)
+        return position
+
+    def read(self, destination, max_records=10):
+        """Read the next pages of a destination without consuming them.
+
+        Args:
+            destination (str): Destination server name
+            max_records (int): Maximum number of pages returned
+
+        Returns:
+            list: (position after the page, sequence number, payload) tuples
+        """
+        head_segment, head_end = self.head()
+        segment, offset = self.position(destination)
+        records = []
+        while len(records) < max_records and (segment, offset) < (head_segment, head_end):
+            path = self._segment_path(segment)
+            if not os.path.exists(path):
+                segment, offset = segment + 1, 0
+                continue
+            end = head_end if segment == head_segment else os.path.getsize(path)
+            if offset >= end:
+                segment, offset = segment + 1, 0
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset < end and len(records) < max_records:
+                    length, seq = RECORD_HEADER.unpack_from(data, offset)
+                    start = offset + RECORD_HEADER.size
+                    offset = start + length
+                    records.append(((segment, offset), seq, data[start:offset]))
+        return records
+
+    def ack(self, destination, position):
+        """Save the read position of a destination after its pages were sent.
+
+        Args:
+            destination (str): Destination server name
+            position (tuple): Position returned by ``read``
+        """
+        self._write_position(os.path.join(self.offsets_dir, destination), position)
+
+    def pending(self, destination):
+        """Return True if the destination has unread pages."""
+        return self.position(destination) < self.head()
+
+    def backlog(self, destination):
+        """Return the number of spooled bytes the destination has not read."""
+        head_segment, head_end = self.head()
+        segment, offset = self.position(destination)
+        backlog = 0
+        for candidate in self._segments():
+            if candidate < segment:
+                continue
+            end = head_end if candidate == head_segment else os.path.getsize(self._segment_path(candidate))
+            backlog += max(0, end - (offset if candidate == segment else 0))
+        return backlog
+
+    def unread(self, destinations):
+        """Return the spooled bytes the destination furthest behind has not read."""
+        return max((self.backlog(destination) for destination in destinations), default=0)
+
+    def size(self):
+        """Return the size of all segments in bytes."""
+        return sum(
+            os.path.getsize(self._segment_path(segment)) for segment in self._segments()
+        )
+
+    def collect_garbage(self, destinations):
+        """Delete segments that every destination has read.
+
+        Args:
+            destinations (list): Names of the configured destinations
+        """
+        if not destinations:
+            return
+        oldest = min(self.position(destination)[0] for destination in destinations)
+        for segment in self._segments():
+            if segment >= oldest or segment >= self.head()[0]:
+                break
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError as e:
+                logger.error(f"Error while removing spool segment {segment}: {e}")
+
+    def trim(self, destinations, reference):
+        """Move unreachable destinations forward so their backlog can be deleted.
+
+        Args:
+            destinations (list): Names of the unreachable destinations
+            reference (list): Names of the reachable destinations
+        """
+        if not reference:
+            return
+        target = min(self.position(destination) for destination in reference)
+        for destination in destinations:
+            if self.position(destination) < target:
+                backlog = self.backlog(destination)
+                self.ack(destination, target)
+                dropped = backlog - self.backlog(destination)
+                logger.error(
+                    f"Spool is full. Dropping {dropped} bytes not yet sent to '{destination}'."
+                )
+                metrics.inc("spool_dropped_bytes_total", dropped, server=destination)
+
+    @contextmanager
+    def consumer(self, destination):
+        """Hold the single consumer slot of a destination across processes.
+
+        Yields:
+            bool: True if the slot was acquired
+        """
+        with self._lock(f"consumer_{destination}", blocking=False) as acquired:
+            yield acquired
+
+
+spool = SegmentSpool()
+
+
+def spool_full():
+    """Return True when collection must pause until destinations catch up.
+
+    Only pages a server has not read count, the head segment stays on disk
+    after every server read it until the next append starts a new one.
+    """
+    conf_data = get_config()
+    max_size = conf_data.get("spool_max_size_mb", 1024) * 1024 * 1024
+    names = [server.name for server in conf_data.servers]
+    if spool.unread(names) < max_size:
+        return False
+    # A down server must not stop collection for the reachable ones. A
+    # half-open server is due for its probe and keeps its pages.
+    down = [name for name in names if breaker_state(name) == OPEN]
+    spool.trim(down, [name for name in names if name not in down])
+    spool.collect_garbage(names)
+    return spool.unread(names) >= max_size
+
+
+def join_events(events):
+    """Build a page payload from encoded events."""
+    return b"\n".join(events)
+
+
+def split_events(payload):
+    """Return the encoded events of a page payload."""
+    return bytes(payload).split(b"\n") if payload else []
@@ -0,0 +1,173 @@
+import datetime
+import socket
+import ssl
+from .serializer import dumps
+
+LOG_USER = 1  # random user-level messages
+LOG_INFO = 6  # informational
+
+HOST_NAME = "VECTRA-SYSLOG-CONNECTOR"
+APP_NAME = "vectra-connector"
+
+RFC3164 = "rfc3164"
+RFC5424 = "rfc5424"
+NON_TRANSPARENT = "non_transparent"
+OCTET_COUNTING = "octet_counting"
+
+
+def encode_event(event):
+    """Serialize one event to the bytes forwarded to syslog servers.
+
+    Events that are already bytes, e.g. from a streamed page, are returned as is.
+    """
+    if isinstance(event, bytes):
+        return event
+    return dumps(event) if isinstance(event, dict) else str(event).encode()
+
+
+def build_header(priority, message_format=RFC3164, timestamp=None):
+    """Build the priority and header prefix shared by all events of a page.
+
+    Args:
+        priority (bytes): Encoded priority, e.g. b"<14>"
+        message_format (str): rfc3164 or rfc5424
+        timestamp (datetime): Message time, defaults to now in UTC
+
+    Returns:
+        bytes: Prefix written before every event
+    """
+    if timestamp is None:
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+    time = timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if message_format == RFC5424:
+        return priority + f"1 {time} {HOST_NAME} {APP_NAME} - - - ".encode()
+    return priority + f"{time} {HOST_NAME}: ".encode()
+
+
+def iter_batches(events, header, framing=NON_TRANSPARENT, max_batch_size=65536):
+    """Frame events for a stream socket into buffers of about max_batch_size bytes.
+
+    Args:
+        events (list): Event bytes
+        header (bytes): Prefix from ``build_header``
+        framing (str): non_transparent or octet_counting
+        max_batch_size (int): Bytes per yielded buffer
+
+    Yields:
+        bytearray: Framed events
+    """
+    buffer = bytearray()
+    octet_counting = framing == OCTET_COUNTING
+    for event in events:
+        if octet_counting:
+            buffer += b"%d " % (len(header) + len(event))
+            buffer += header
+            buffer += event
+        else:
+            buffer += header
+            buffer += event
+            buffer += b"\n"
+        if len(buffer) >= max_batch_size:
+            yield buffer
+            buffer = bytearray()
+    if buffer:
+        yield buffer
+
+
+class SyslogWriter:
+    """Syslog writer for pre-serialized events.
+
+    Frames are built directly from event bytes and a header prefix computed
+    once per page, without going through the logging module.
+    """
+
+    def __init__(
+        self,
+        protocol,
+        address,
+        certs=None,
+        message_format=RFC3164,
+        framing=NON_TRANSPARENT,
+        facility=LOG_USER,
+        severity=LOG_INFO,
+        max_batch_size=65536,
+        timeout=60,
+    ) -> None:
+        """Initialization function
+
+        Args:
+            protocol (str): One of TCP, UDP or TLS
+            address (tuple): Server host and port
+            certs (str): CA certificate path for TLS servers
+            message_format (str): rfc3164 or rfc5424 header
+            framing (str): non_transparent (LF) or octet_counting (RFC 6587)
+            facility (int): Syslog facility
+            severity (int): Syslog severity
+            max_batch_size (int): Bytes buffered before each socket write
+            timeout (int): Socket timeout in seconds
+        """
+        self.protocol = protocol.upper()
+        self.address = address
+        self.message_format = message_format
+        self.framing = framing
+        self.max_batch_size = max_batch_size
+        self.priority = b"<%d>" % (facility << 3 | severity)
+        self.socktype = (
+            socket.SOCK_DGRAM if self.protocol == "UDP" else socket.SOCK_STREAM
+        )
+        self.socket = self._connect(certs, timeout)
+
+    def _connect(self, certs, timeout):
+        host, port = self.address
+        if self.socktype == socket.SOCK_DGRAM:
+            family, _, _, _, self.sockaddr = socket.getaddrinfo(
+                host, port, 0, socket.SOCK_DGRAM
+            )[0]
+            return socket.socket(family, socket.SOCK_DGRAM)
+
+        sock = socket.create_connection(self.address, timeout=timeout)
+        if self.protocol == "TLS":
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            if certs:
+                context.verify_mode = ssl.CERT_REQUIRED
+                context.load_verify_locations(cafile=certs)
+            else:
+                context.verify_mode = ssl.CERT_NONE
+            try:
+                sock = context.wrap_socket(sock)
+            except Exception:
+                sock.close()
+                raise
+        return sock
+
+    def header(self, timestamp=None):
+        """Build the header prefix of a page, see ``build_header``."""
+        return build_header(self.priority, self.message_format, timestamp)
+
+    def write_events(self, events, header):
+        """Send pre-serialized events using as few socket writes as possible.
+
+        UDP sends one datagram per event. Socket errors are raised.
+
+        Args:
+            events (list): Event bytes
+            header (bytes): Prefix from ``header``
+
+        Returns:
+            int: Number of bytes sent
+        """
+        sent = 0
+        if self.socktype == socket.SOCK_DGRAM:
+            for event in events:
+                sent += self.socket.sendto(header + event + b"\n", self.sockaddr)
+            return sent
+
+        for buffer in iter_batches(events, header, self.framing, self.max_batch_size):
+            self.socket.sendall(buffer)
+            sent += len(buffer)
+        return sent
+
+    def close(self):
+        """Close the connection."""
+        self.socket.close()
@@ -1,81 +1,178 @@
 from .celery import app
+import fcntl
 import os
-import psutil
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from .checkpoint import Checkpoint
+from .config import get_config
+from .dedup import get_dedup
+from .event_filter import get_event_filter
 from .vectra_api import VectraAPI
 from .logger import logger
+from .serializer import loads
+from .spool import spool_full
 
+BACKFILL_DIR = "./backfill"
 
-def check_disk_space():
-    try:
-        disk_info = psutil.disk_usage("/")
-        use_percent = round(disk_info.percent)
-        return use_percent
-    except Exception as e:
-        logger.error(f"Exception in checking disk space {e}")
-        return None
+# Independent collection streams, each with its own checkpoint
+STREAMS = {
+    "audit": {
+        "schedule": "audit",
+        "title": "Audit",
+        "path": "/api/v3.3/events/audits",
+        "params": {},
+        "checkpoint": "audit",
+    },
+    "detections": {
+        "schedule": "detections",
+        "title": "Detection",
+        "path": "/api/v3.3/events/detections",
+        "params": {},
+        "checkpoint": "detection",
+    },
+    "entity_account": {
+        "schedule": "entity_scoring",
+        "title": "Entity account",
+        "path": "/api/v3.3/events/entity_scoring",
+        "params": {"type": "account"},
+        "checkpoint": "entity_account",
+    },
+    "entity_host": {
+        "schedule": "entity_scoring",
+        "title": "Entity host",
+        "path": "/api/v3.3/events/entity_scoring",
+        "params": {"type": "host"},
+        "checkpoint": "entity_host",
+    },
+}
 
 
-@app.task
-def get_data_from_audit_api():
-    """Celery task for fetch data from audit API.
+def stream_params(stream):
+    """Build the first request parameters of a stream run.
+
+    Without a checkpoint, collection starts from the last 24 hours.
+
+    Args:
+        stream (str): Stream name
 
     Returns:
-        dict: Audit Events
+        dict: Query parameters
     """
-    disk_usage_percent = check_disk_space()
-    if disk_usage_percent is None:
-        return None
-    if int(disk_usage_percent) >= 70:
-        logger.info(f"Disk usage is {disk_usage_percent} %. Hence, stop pulling Audit API data.")
-        return None
-    logger.info("Executing Audit API task.")
-    logger.info(f"Disk usage {disk_usage_percent} %.")
-    URL = f"{str(os.environ.get('BASE_URL')).strip().strip('/')}/api/v3.3/events/audits"
-    checkpoint_file_path = "./audit_checkpoint.json"
-    params = {}
-    if not os.path.exists(checkpoint_file_path):
+    spec = STREAMS[stream]
+    params = dict(spec["params"])
+    if not Checkpoint.has_checkpoint(spec["checkpoint"]):
         current_time = datetime.utcnow()
         # Subtract 24 hours
         new_time = current_time - timedelta(hours=24)
         # Format as "2023-05-31T14:10:00Z"
         formatted_time = new_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-        params = {"event_timestamp_gte": formatted_time}
-    total_data = VectraAPI.fetch_data_from_api(url=URL, filename="audit", params=params)
-    return total_data
+        params.update({"event_timestamp_gte": formatted_time})
+    return params
+
+
+def backfill_state_path(stream):
+    """Return the state file of a stream backfill, see backfill.py."""
+    return os.path.join(BACKFILL_DIR, f"{stream}.json")
+
+
+def live_backfill(stream):
+    """Return True if a backfill that continues into live collection is in progress.
+
+    Such a backfill sets the live checkpoint when it completes. A backfill
+    with an end time leaves the live checkpoint alone.
+    """
+    try:
+        with open(backfill_state_path(stream), "rb") as f:
+            return loads(f.read()).get("until") is None
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        logger.error(f"Backfill state of '{stream}' is corrupted or not in correct json format.")
+        return True
+
+
+@contextmanager
+def stream_slot(stream):
+    """Hold the run slot of a stream across worker processes.
+
+    A stream has a single checkpoint, so a second run would pull the same pages.
+
+    Args:
+        stream (str): Stream name
+
+    Yields:
+        bool: True if the slot was acquired
+    """
+    os.makedirs("./locks", exist_ok=True)
+    lock_file = open(f"./locks/{stream}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
 
 
 @app.task
-def get_data_from_entity_api():
-    """Celery task for fetch data from entity_scoring API.
+def collect_stream(stream):
+    """Celery task for fetch data of one stream.
+
+    Args:
+        stream (str): Stream name, one of STREAMS
 
     Returns:
-        dict: entity_scoring Events
+        bool: True if the stream was pulled to its end, None if the run was skipped
     """
-    URL = f"{str(os.environ.get('BASE_URL')).strip().strip('/')}/api/v3.3/events/entity_scoring"
-    types = {
-        "account": "./entity_account_checkpoint.json",
-        "host": "./entity_host_checkpoint.json",
-    }
-    for typ, checkpoint_path in types.items():
-        disk_usage_percent = check_disk_space()
-        if disk_usage_percent is None:
-            return None
-        if int(disk_usage_percent) >= 70:
-            logger.info(f"Disk usage is {disk_usage_percent} %. Hence, stop pulling Entity Scoring API data.")
+    spec = STREAMS[stream]
+    settings = get_config().get("streams", {}).get(stream, {})
+    if spool_full():
+        logger.info(f"Spool is full. Hence, stop pulling {spec['title']} API data.")
+        return None
+    if live_backfill(stream):
+        logger.info(f"{spec['title']} backfill is in progress. Skipping this run.")
+        return None
+    with stream_slot(stream) as acquired:
+        if not acquired:
+            logger.info(f"{spec['title']} API task is already running. Skipping this run.")
             return None
-        logger.info(f"Executing Entity {typ} API task.")
-        logger.info(f"Disk usage {disk_usage_percent} %.")
-        params = {"type": typ}
-        if not os.path.exists(checkpoint_path):
-            current_time = datetime.utcnow()
-            new_time = current_time - timedelta(hours=24)
-            formatted_time = new_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-            params.update({"event_timestamp_gte": formatted_time})
-        total_data = VectraAPI.fetch_data_from_api(
-            url=URL, params=params, filename=f"entity_{typ}"
+        logger.info(f"Executing {spec['title']} API task.")
+        URL = f"{str(os.environ.get('BASE_URL')).strip().strip('/')}{spec['path']}"
+        params = stream_params(stream)
+        return VectraAPI.fetch_data_from_api(
+            url=URL,
+            filename=spec["checkpoint"],
+            params=params,
+            requests_per_minute=settings.get("requests_per_minute"),
+            event_filter=get_event_filter(stream),
+            dedup=get_dedup(stream),
+            stream=stream,
         )
-    return total_data
+
+
+@app.task
+def get_data_from_audit_api():
+    """Celery task for fetch data from audit API.
+
+    Returns:
+        bool: True if the stream was pulled to its end
+    """
+    return collect_stream("audit")
+
+
+@app.task
+def get_data_from_entity_api():
+    """Celery task for fetch data from entity_scoring API.
+
+    The account and host streams are collected as separate tasks so that
+    they run concurrently.
+    """
+    for stream in ("entity_account", "entity_host"):
+        collect_stream.delay(stream)
 
 
 @app.task
@@ -83,25 +180,6 @@ def get_data_from_detection():
     """Celery task for fetch data from detections API.
 
     Returns:
-        dict: Detections Events
+        bool: True if the stream was pulled to its end
     """
-    disk_usage_percent = check_disk_space()
-    if disk_usage_percent is None:
-        return None
-    if int(disk_usage_percent) >= 70:
-        logger.info(f"Disk usage is {disk_usage_percent} %. Hence, stop pulling Detection API data.")
-        return None
-    logger.info("Executing Detection API task.")
-    logger.info(f"Disk usage {disk_usage_percent} %.")
-    URL = f"{str(os.environ.get('BASE_URL')).strip().strip('/')}/api/v3.3/events/detections"
-    checkpoint_file_path = "./detection_checkpoint.json"
-    params = {}
-    if not os.path.exists(checkpoint_file_path):
-        current_time = datetime.utcnow()
-        new_time = current_time - timedelta(hours=24)
-        formatted_time = new_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-        params = {"event_timestamp_gte": formatted_time}
-    total_data = VectraAPI.fetch_data_from_api(
-        url=URL, filename="detection", params=params
-    )
-    return total_data
+    return collect_stream("detections")
@@ -2,8 +2,9 @@ import jsonschema
 import json
 import sys
 import socket
-import ssl
+from .circuit_breaker import record_failure, record_success
 from .logger import logger
+from .syslog_writer import SyslogWriter
 
 # Config schema
 configSchema = {
@@ -13,7 +14,69 @@ configSchema = {
             "pattern": r"^(?:(?:(\*|\d{1,2}|\d{1,2}-\d{1,2}|\d{1,2}\/\d{1,2}|\d{1,2},\d{1,2}|\?|\*\/\d{1,2})\s+){4}"
             r"(\*|\d{1,2}|\d{1,2}-\d{1,2}|\d{1,2}\/\d{1,2}|\d{1,2},\d{1,2}|\?|\*\/\d{1,2}))$",
             "error_msg": "Please provide valid cron expression.",
-        }
+        },
+        "stream_properties": {
+            "type": "object",
+            "properties": {
+                "requests_per_minute": {
+                    "type": "number",
+                    "exclusiveMinimum": 0,
+                    "error_msg": "Please provide valid requests_per_minute. Should be a positive number.",
+                },
+                "filter": {
+                    "type": "object",
+                    "properties": {
+                        "fields": {
+                            "type": "array",
+                            "items": {"type": "string", "minLength": 1},
+                            "minItems": 1,
+                            "error_msg": "Please provide valid filter fields. Should be a list of field names.",
+                        },
+                        "conditions": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "field": {"type": "string", "minLength": 1},
+                                    "operator": {
+                                        "enum": ["eq", "ne", "gt", "gte", "lt", "lte", "in", "not_in"],
+                                        "error_msg": "Please provide valid filter operator. Should be one of eq, ne, gt, gte, lt, lte, in or not_in.",
+                                    },
+                                    "value": {},
+                                },
+                                "required": ["field", "operator", "value"],
+                                "additionalProperties": False,
+                            },
+                            "error_msg": "Please provide valid filter conditions. Every condition needs field, operator and value.",
+                        },
+                    },
+                    "additionalProperties": False,
+                },
+                "dedup": {
+                    "type": "object",
+                    "properties": {
+                        "key": {
+                            "type": "array",
+                            "items": {"type": "string", "minLength": 1},
+                            "minItems": 1,
+                            "error_msg": "Please provide valid dedup key. Should be a list of field names.",
+                        },
+                        "ttl": {
+                            "type": "number",
+                            "exclusiveMinimum": 0,
+                            "error_msg": "Please provide valid dedup ttl. Should be a positive number of seconds.",
+                        },
+                        "max_entries": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "error_msg": "Please provide valid dedup max_entries. Should be a positive integer.",
+                        },
+                    },
+                    "required": ["key"],
+                    "additionalProperties": False,
+                },
+            },
+        },
     },
     "type": "object",
     "properties": {
@@ -51,6 +114,22 @@ configSchema = {
                                 "maximum": 65535,
                                 "error_msg": "Please provide valid integer Port Number. Should be in range 1 to 65535",
                             },
+                            "retry_count": {
+                                "type": "number",
+                                "error_msg": "Please provide number not string.",
+                            },
+                            "syslog_format": {
+                                "type": "string",
+                                "enum": ["rfc3164", "rfc5424"],
+                                "error_msg": "Please provide valid syslog_format. "
+                                "Should be one of ['rfc3164', 'rfc5424']",
+                            },
+                            "framing": {
+                                "type": "string",
+                                "enum": ["non_transparent", "octet_counting"],
+                                "error_msg": "Please provide valid framing. "
+                                "Should be one of ['non_transparent', 'octet_counting']",
+                            },
                         },
                         "required": [
                             "name",
@@ -71,10 +150,82 @@ configSchema = {
                     },
                     "required": ["audit", "detections", "entity_scoring"],
                 },
+                "streams": {
+                    "type": "object",
+                    "properties": {
+                        "audit": {"$ref": "#/definitions/stream_properties"},
+                        "detections": {"$ref": "#/definitions/stream_properties"},
+                        "entity_account": {"$ref": "#/definitions/stream_properties"},
+                        "entity_host": {"$ref": "#/definitions/stream_properties"},
+                    },
+                    "additionalProperties": False,
+                    "error_msg": "Please provide valid streams. "
+                    "Should be any of ['audit', 'detections', 'entity_account', 'entity_host']",
+                },
                 "retry_count": {
                     "type": "number",
                     "error_msg": "Please provide number not string.",
                 },
+                "max_batch_size": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "error_msg": "Please provide valid max_batch_size. Should be a positive number of bytes.",
+                },
+                "page_size": {
+                    "type": "integer",
+                    "minimum": 100,
+                    "error_msg": "Please provide valid page_size. Should be an integer of at least 100.",
+                },
+                "api_requests_per_minute": {
+                    "type": "number",
+                    "minimum": 6,
+                    "error_msg": "Please provide valid api_requests_per_minute. Should be a number of at least 6.",
+                },
+                "checkpoint_commit_interval": {
+                    "type": "number",
+                    "minimum": 0,
+                    "error_msg": "Please provide valid checkpoint_commit_interval. Should be a number of seconds.",
+                },
+                "stream_parsing": {
+                    "type": "boolean",
+                    "error_msg": "Please provide valid stream_parsing. Should be true or false.",
+                },
+                "metrics_port": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "maximum": 65535,
+                    "error_msg": "Please provide valid metrics_port. Should be a port number, 0 disables metrics.",
+                },
+                "prefetch_depth": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "error_msg": "Please provide valid prefetch_depth. Should be a positive integer.",
+                },
+                "http_pool_size": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "error_msg": "Please provide valid http_pool_size. Should be a positive integer.",
+                },
+                "engine": {
+                    "type": "string",
+                    "enum": ["celery", "asyncio"],
+                    "error_msg": "Please provide valid engine. Should be one of ['celery', 'asyncio']",
+                },
+                "spool_max_size_mb": {
+                    "type": "number",
+                    "exclusiveMinimum": 0,
+                    "error_msg": "Please provide valid spool_max_size_mb. Should be a positive number.",
+                },
+                "connection_idle_timeout": {
+                    "type": "number",
+                    "minimum": 0,
+                    "error_msg": "Please provide valid connection_idle_timeout. Should be 0 or more seconds.",
+                },
+                "task_compression": {
+                    "type": "string",
+                    "enum": ["none", "zlib", "zstd"],
+                    "error_msg": "Please provide valid task_compression. Should be one of ['none', 'zlib', 'zstd']",
+                },
             },
             "required": ["server", "scheduler", "retry_count"],
         }
@@ -85,7 +236,7 @@ configSchema = {
 
 def read_config():
     try:
-        logger.info("Reading 'conf.json'.")
+        logger.info("Reading 'config.json'.")
         with open("./config.json", "r") as f:
             conf_data = json.load(f)
         return conf_data
@@ -123,80 +274,31 @@ def validate_config_json(jsonData):
 
 
 def test_connectivity_syslog(json_data):
-    """Test configured server is reachable or not.
+    """Test configured server is reachable or not and update its circuit breaker.
 
     Args:
         json_data (dict): Read config data from config.json
     """
-    server_status = {}
-    for server in range(len(json_data.get("configuration").get("server"))):
-        server_host = str(
-            json_data.get("configuration").get("server")[server].get("server_host")
-        ).strip()
-        server_port = int(
-            json_data.get("configuration").get("server")[server].get("server_port")
-        )
-        server_name = str(
-            json_data.get("configuration").get("server")[server].get("name")
-        ).strip()
-        server_protocol = str(
-            json_data.get("configuration").get("server")[server].get("server_protocol")
-        ).strip()
+    for server in json_data.get("configuration").get("server"):
+        server_host = str(server.get("server_host")).strip()
+        server_port = int(server.get("server_port"))
+        server_name = str(server.get("name")).strip()
+        server_protocol = str(server.get("server_protocol")).strip()
         logger.info(f"Testing connectivity for server '{server_name}'")
-        status = True
-        if server_protocol.upper() == "TLS":
-            try:
-                tls_certificate_path = f"./cert/{server_name}.pem"
-
-                tls_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                tls_socket.settimeout(60)
-                tls_wrap_sock = ssl.wrap_socket(
-                    tls_socket,
-                    ca_certs=tls_certificate_path,
-                    cert_reqs=ssl.CERT_REQUIRED,
-                )
-
-                # Connect to the TLS server
-                logger.info(f"Connecting {server_protocol} server '{server_name}'")
-                tls_wrap_sock.connect((server_host, server_port))
-                logger.info(f"Server '{server_name}' is connected.")
-                tls_wrap_sock.close()
-
-            except socket.error as e:
-                logger.error(f"Connection error: {str(e)}")
-                status = False
-            except Exception as e:
-                logger.error(f"An error occurred: {str(e)}")
-                status = False
-                sys.exit()
-            finally:
-                server_status.update({f"{server_name}": status})
-
-        else:
-            # Set UDP socket by default
-            socket_type = socket.SOCK_DGRAM
-            if server_protocol.upper() == "TCP":
-                # Set TCP socket
-                socket_type = socket.SOCK_STREAM
-            try:
-                server_socket = socket.socket(socket.AF_INET, socket_type)
-                server_socket.settimeout(60)
-
-                logger.info(f"Connecting {server_protocol} server '{server_name}'")
-                server_socket.connect((server_host, server_port))
-                logger.info(f"Server '{server_name}' is connected.")
-                server_socket.close()
-
-            except socket.error as e:
-                logger.error(f"Connection error: {str(e)}")
-                status = False
-            except Exception as e:
-                logger.error(f"An error occurred: {str(e)}")
-                status = False
-                sys.exit()
-            finally:
-                server_status.update({f"{server_name}": status})
-    with open("./server_status.json", "w") as file:
-        file.write(json.dumps(server_status))
-    if len(json_data.get("configuration").get("server")) == 1 and not status:
-        sys.exit()
+        try:
+            logger.info(f"Connecting {server_protocol} server '{server_name}'")
+            SyslogWriter(
+                server_protocol,
+                (server_host, server_port),
+                certs=f"./cert/{server_name}.pem" if server_protocol.upper() == "TLS" else None,
+            ).close()
+            logger.info(f"Server '{server_name}' is connected.")
+        except socket.error as e:
+            logger.error(f"Connection error: {str(e)}")
+            # Unreachable servers are probed again later
+            record_failure(server_name)
+            continue
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            sys.exit()
+        record_success(server_name)
@@ -1,18 +1,38 @@
 import os
+import queue
 import sys
+import threading
 import time
 import backoff
 import requests
-from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover - optional dependency
+    ijson = None
+from . import metrics
 from .logger import logger
+from .profiling import StageTimer
 from .checkpoint import Checkpoint
 from .exception import CustomException, TooManyRequestException
+from .lanes import lane_queue
 from .push_data_to_syslog import push_data_to_syslog
-from .validate_config import read_config
+from .serializer import loads
+from .spool import join_events, spool, spool_full
+from .syslog_writer import encode_event
+from .config import get_config
+from .event_filter import filter_events, filter_keyed_events
+from .fetch_control import get_fetch_controller, retry_after
+from .http_session import BearerAuth, get_session
 
 AUTH_URL = f"{str(os.environ.get('BASE_URL')).strip().strip('/')}/oauth2/token"
 CLIENT_ID = str(os.environ.get("CLIENT_ID")).strip()
 CLIENT_SECRET = str(os.environ.get("CLIENT_SECRET")).strip()
+# Compressed bytes read from the response per parse step
+STREAM_CHUNK_SIZE = 16384
+# 429 responses in a row before a page fetch is given up
+MAX_THROTTLED_REQUESTS = 5
 
 
 def kill_process_and_exit(e):
@@ -20,6 +40,33 @@ def kill_process_and_exit(e):
     sys.exit()
 
 
+def streaming_enabled():
+    """Return True if pages are parsed while they are downloaded."""
+    if not get_config().get("stream_parsing", False):
+        return False
+    if ijson is None:
+        logger.error("Streaming page parsing requires ijson. Parsing whole pages.")
+        return False
+    return True
+
+
+def api_session():
+    """Return the keep-alive session used for Vectra API requests."""
+    return get_session(pool_size=get_config().get("http_pool_size", 10))
+
+
+def release_response(req):
+    """Read a streamed response to its end and return its connection to the pool.
+
+    The body stays available, e.g. for logging the error of a failed page.
+    """
+    try:
+        req.content
+    except requests.exceptions.RequestException:
+        pass
+    req.close()
+
+
 class Auth:
     def __init__(self) -> None:
         """Initialization Function"""
@@ -47,7 +94,7 @@ class Auth:
         try:
             CLIENT_ID = str(os.environ.get("CLIENT_ID")).strip()
             CLIENT_SECRET = str(os.environ.get("CLIENT_SECRET")).strip()
-            res = requests.post(
+            res = api_session().post(
                 AUTH_URL,
                 auth=(CLIENT_ID, CLIENT_SECRET),
                 data={"grant_type": "client_credentials"},
@@ -103,7 +150,7 @@ class Auth:
         global access_token
         logger.info("Generating access token using refresh token.")
         try:
-            res = requests.post(
+            res = api_session().post(
                 AUTH_URL,
                 data={"grant_type": "refresh_token", "refresh_token": f"{refresh_token}"},
                 timeout=30,
@@ -139,6 +186,239 @@ class Auth:
 global access_token
 global refresh_token
 access_token, refresh_token = Auth.auth_token()
+# Reads the latest token, so a refreshed token is used by in-flight fetches
+bearer_auth = BearerAuth(lambda: access_token)
+
+
+class _ChunkReader:
+    """File-like view of decoded response chunks.
+
+    Reading the raw response directly lets one read decompress far more
+    than the requested size, which ijson then parses in one go.
+    """
+
+    def __init__(self, chunks) -> None:
+        self.chunks = chunks
+        self.buffer = b""
+
+    def read(self, size=-1):
+        if not self.buffer:
+            self.buffer = next(self.chunks, b"")
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def drain(self):
+        """Read the rest of the body, e.g. the gzip trailer after the JSON document."""
+        for _ in self.chunks:
+            pass
+
+
+def read_page_stream(req, event_filter=None, event_key=None):
+    """Parse a page while it is downloaded, encoding each event as soon as it is complete.
+
+    Only the encoded events are kept, never the whole body or the parsed
+    event list.
+
+    Args:
+        req (requests.Response): Response opened with stream=True
+        event_filter (function): Compiled filter of the stream
+        event_key (function): Identity of an event for deduplication
+
+    Returns:
+        dict: Page with encoded events, the number of received events,
+            next_checkpoint, remaining_count and the timestamp of the last
+            event, plus the identity keys of the events with event_key
+    """
+    body = {"events": [], "received": 0}
+    if event_key is not None:
+        body["keys"] = []
+    builder = None
+    try:
+        chunks = _ChunkReader(req.iter_content(STREAM_CHUNK_SIZE))
+        for prefix, event, value in ijson.parse(chunks, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == "events.item" and event == "end_map":
+                    body["received"] += 1
+                    event = original = builder.value
+                    builder = None
+                    if event_filter is not None:
+                        event = event_filter(event)
+                    if event is not None:
+                        body["events"].append(encode_event(event))
+                        if event_key is not None:
+                            body["keys"].append(event_key(original))
+            elif prefix == "events.item" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix in ("next_checkpoint", "remaining_count"):
+                body[prefix] = value
+            if prefix == "events.item.event_timestamp":
+                body["newest_event"] = value
+        # A fully read response returns its connection to the keep-alive pool
+        chunks.drain()
+    except ijson.JSONError as e:
+        raise ValueError(str(e)) from e
+    finally:
+        req.close()
+    return body
+
+
+class PagePrefetcher:
+    """Fetch the pages of an endpoint ahead of their processing.
+
+    A background thread requests page N+1 as soon as the next_checkpoint of
+    page N is known, keeping at most ``depth`` fetched pages in memory.
+    """
+
+    def __init__(
+        self,
+        url,
+        params,
+        checkpoint,
+        depth=2,
+        min_interval=0,
+        controller=None,
+        streaming=False,
+        event_filter=None,
+        event_key=None,
+        timer=None,
+    ) -> None:
+        """Initialization function
+
+        Args:
+            url (str): URL for event collection
+            params (dict): Query parameters
+            checkpoint (int): Checkpoint of the first page
+            depth (int): Maximum number of pages fetched ahead
+            min_interval (float): Minimum seconds between two requests
+            controller (FetchController): Shared request budget and page size
+            streaming (bool): Parse pages while they are downloaded, requires ijson
+            event_filter (function): Compiled filter applied to the events of every page
+            event_key (function): Identity of an event, adds the keys of the events to every page
+            timer (StageTimer): Timer of the run, times the request and parse stages
+        """
+        self.url = url
+        self.params = dict(params)
+        self.checkpoint = checkpoint
+        self.min_interval = min_interval
+        self.controller = controller
+        self.streaming = streaming
+        self.event_filter = event_filter
+        self.event_key = event_key
+        self.endpoint = urlparse(url).path
+        self.timer = timer or StageTimer("fetch", url)
+        self._pages = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        """Yield (response, body) pairs in page order.
+
+        The body is None when the response is not successful. A request
+        failure is yielded as the exception instead of the response.
+        """
+        while True:
+            with self.timer.stage("wait"):
+                page = self._pages.get()
+            if page is None:
+                return
+            yield page
+
+    def close(self):
+        """Stop fetching and release pages that were not consumed."""
+        self._stopped.set()
+        while True:
+            try:
+                self._pages.get_nowait()
+            except queue.Empty:
+                break
+
+    def _put(self, page):
+        while not self._stopped.is_set():
+            try:
+                self._pages.put(page, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        checkpoint = self.checkpoint
+        last_request = None
+        throttled = 0
+        try:
+            while not self._stopped.is_set():
+                delay = 0
+                if last_request is not None and self.min_interval:
+                    delay = last_request + self.min_interval - time.monotonic()
+                if self.controller is not None:
+                    delay = max(delay, self.controller.reserve())
+                    self.params.update({"limit": self.controller.page_size()})
+                if delay > 0 and self._stopped.wait(delay):
+                    return
+                last_request = time.monotonic()
+                self.params.update({"from": checkpoint})
+                try:
+                    with self.timer.stage("request"):
+                        req = api_session().get(
+                            self.url, auth=bearer_auth, params=self.params, stream=self.streaming
+                        )
+                except requests.exceptions.RequestException as e:
+                    self._put((e, None))
+                    return
+                if req.status_code == 429 and self.controller is not None:
+                    self.controller.record_throttle(retry_after(req))
+                    metrics.inc("api_throttled_total", endpoint=self.endpoint)
+                    throttled += 1
+                    if throttled < MAX_THROTTLED_REQUESTS:
+                        # The bucket now waits for Retry-After, ask for the same page again
+                        release_response(req)
+                        continue
+                if req.status_code != 200:
+                    release_response(req)
+                    self._put((req, None))
+                    return
+                try:
+                    if self.streaming:
+                        # Includes the download of the body
+                        with self.timer.stage("parse"):
+                            body = read_page_stream(req, self.event_filter, self.event_key)
+                        size = req.raw.tell()
+                    else:
+                        with self.timer.stage("parse"):
+                            body = loads(req.content)
+                        size = len(req.content)
+                        events = body.get("events") or []
+                        body["received"] = len(events)
+                        if events:
+                            body["newest_event"] = events[-1].get("event_timestamp")
+                        with self.timer.stage("filter"):
+                            if self.event_key is not None:
+                                body["events"], body["keys"] = filter_keyed_events(
+                                    events, self.event_filter, self.event_key
+                                )
+                            else:
+                                body["events"] = filter_events(events, self.event_filter)
+                except (ValueError, requests.exceptions.RequestException) as e:
+                    self._put((e, None))
+                    return
+                throttled = 0
+                metrics.observe(
+                    "api_request_seconds", req.elapsed.total_seconds(), endpoint=self.endpoint
+                )
+                if self.controller is not None:
+                    self.controller.record_response(req.elapsed.total_seconds(), size)
+                if not self._put((req, body)):
+                    return
+                if not body["received"] or body.get("remaining_count") == 0:
+                    return
+                checkpoint = body.get("next_checkpoint")
+        finally:
+            self._put(None)
 
 
 class VectraAPI:
@@ -159,79 +439,155 @@ class VectraAPI:
         max_time=30,
         on_giveup=kill_process_and_exit,
     )
-    def fetch_data_from_api(url, filename, params=None):
+    def fetch_data_from_api(
+        url,
+        filename,
+        params=None,
+        requests_per_minute=None,
+        event_filter=None,
+        dedup=None,
+        stream=None,
+    ):
         """Collect events from Vectra APIs.
 
         Args:
             access_token (str): Access token for API authentication
             url (str): URL for event collection
+            requests_per_minute (int): Request budget of the stream
+            event_filter (function): Compiled filter of the stream, see event_filter.py
+            dedup (StreamDedup): Deduplication of the stream, see dedup.py
+            stream (str): Stream name for the metrics, defaults to the checkpoint name
 
         Returns:
-            dict: Events
+            bool: True if the stream was pulled to its end, False if the run
+                stopped early, e.g. because the spool is full
         """
         global access_token
         global refresh_token
         if params is None:
             params = {}
-        params.update({"limit": 1000})
-
-        headers = {"Authorization": f"Bearer {access_token}"}
-        remaining_count = -1
-        conf_data = read_config()
-        while remaining_count != 0:
-            next_checkpoint = Checkpoint.read_checkpoint_from_file(filename)
-            if next_checkpoint == -1:
-                current_time = datetime.utcnow()
-                # Subtract 24 hours
-                new_time = current_time - timedelta(hours=24)
-                # Format as "2023-05-31T14:10:00Z"
-                formatted_time = new_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-                params.update({"event_timestamp_gte": formatted_time})
-                next_checkpoint = 0
-            params.update({"from": next_checkpoint})
-            try:
-                logger.info(f"Started Events Collection for '{filename}'.")
-                req = requests.get(url, headers=headers, params=params)
-                if req.status_code == 401:
-                    raise CustomException(
-                        f"Status-code {req.status_code} Exception {req.text}"
+        controller = get_fetch_controller(url, get_config())
+        params.update({"limit": controller.page_size()})
+        stream = stream or filename
+        page_count = 0
+        timer = StageTimer("fetch", filename)
+
+        total_data = None
+        complete = False
+        next_checkpoint = Checkpoint.read_checkpoint_from_file(filename)
+        pages = PagePrefetcher(
+            url,
+            params,
+            next_checkpoint,
+            depth=get_config().get("prefetch_depth", 2),
+            min_interval=60 / requests_per_minute if requests_per_minute else 0,
+            controller=controller,
+            streaming=streaming_enabled(),
+            event_filter=event_filter,
+            event_key=dedup.key if dedup is not None else None,
+            timer=timer,
+        )
+        try:
+            for req, body in pages:
+                try:
+                    logger.info(f"Started Events Collection for '{filename}'.")
+                    if isinstance(req, Exception):
+                        raise req
+                    if req.status_code == 401:
+                        raise CustomException(
+                            f"Status-code {req.status_code} Exception {req.text}"
+                        )
+                    if req.status_code == 429:
+                        raise TooManyRequestException("Too many requests.")
+                    req.raise_for_status()
+                    total_data = {"events": body.get("events")}
+                    if body["received"] < 1:
+                        logger.info(f"No new events for '{filename}'.")
+                        return True
+                    page_count += 1
+                    metrics.inc("events_fetched_total", body["received"], stream=stream)
+                    newest_event = metrics.parse_timestamp(body.get("newest_event"))
+                    if newest_event is not None:
+                        metrics.set_max("newest_event_timestamp_seconds", newest_event, stream=stream)
+                    logger.info(f"Events collected for '{filename}'.")
+                    seq = None
+                    keys, duplicates = None, 0
+                    if dedup is not None and total_data["events"]:
+                        with timer.stage("dedup"):
+                            total_data["events"], keys, duplicates = dedup.drop_seen(
+                                total_data["events"], body["keys"]
+                            )
+                    if total_data["events"]:
+                        if spool_full():
+                            logger.info(
+                                f"Spool is full. Pausing collection for '{filename}' until servers catch up."
+                            )
+                            return False
+                        # Encode once, every destination reads the same spooled page.
+                        # The page and its checkpoint are committed together.
+                        with timer.stage("encode"):
+                            payload = join_events(
+                                [encode_event(event) for event in total_data["events"]]
+                            )
+                        with timer.stage("spool"):
+                            seq = spool.append(
+                                payload, checkpoint=(filename, body.get("next_checkpoint"))
+                            )
+                        metrics.inc("events_spooled_total", len(total_data["events"]), stream=stream)
+                        if dedup is not None:
+                            # Remembered once spooled, a crash before can only re-send
+                            dedup.remember(keys, hits=duplicates)
+                    elif duplicates:
+                        dedup.remember([], hits=duplicates)
+                    else:
+                        logger.info(f"All events of the page were filtered for '{filename}'.")
+                    with timer.stage("checkpoint"):
+                        Checkpoint.save_checkpoint_to_file(
+                            checkpoint={
+                                f"{filename}_next_checkpoint": body.get("next_checkpoint"),
+                            },
+                            file_name=filename,
+                            seq=seq,
+                        )
+                    if seq is not None:
+                        with timer.stage("enqueue"):
+                            for server in get_config().servers:
+                                push_data_to_syslog.apply_async(
+                                    args=[None, server.index], queue=lane_queue(server)
+                                )
+                    # The prefetcher stops after the last page
+                    complete = body.get("remaining_count") == 0
+
+                except CustomException as e:
+                    logger.error(f"Error occurred: {e}")
+                    access_token = Auth.auth_token_using_refresh_token()
+                    raise CustomException
+                except TooManyRequestException as e:
+                    # The shared bucket already waits for Retry-After
+                    logger.info(f"{e}. Retrying after {retry_after(req)} seconds.")
+                    raise TooManyRequestException from e
+                except requests.exceptions.HTTPError:
+                    logger.error("Vectra API server is down. Retrying after 10 seconds.")
+                    time.sleep(10)
+                    raise requests.exceptions.HTTPError
+                except requests.exceptions.RequestException as req_exception:
+                    logger.error(f"Retrying. An exception occurred: {req_exception}")
+                    raise requests.exceptions.RequestException from req_exception
+                except Exception as e:
+                    # The next page was already requested from this page's checkpoint,
+                    # continuing would skip this page
+                    logger.error(
+                        f"An exception occurred: {e}. Stopping collection for '{filename}', "
+                        "the next run resumes from the last saved checkpoint."
                     )
-                req.raise_for_status()
-                total_data = {"events": req.json().get("events")}
-                if len(total_data["events"]) < 1:
-                    logger.info(f"No new events for '{filename}'.")
-                    return
-                logger.info(f"Events collected for '{filename}'.")
-                Checkpoint.save_checkpoint_to_file(
-                    checkpoint={
-                        f"{filename}_next_checkpoint": req.json().get(
-                            "next_checkpoint"
-                        ),
-                    },
-                    file_name=filename,
-                )
-                for index in range(len(conf_data.get("configuration").get("server"))):
-                    total_data["server"] = index
-                    push_data_to_syslog.delay(total_data, index)
-                remaining_count = req.json().get("remaining_count")
-
-            except CustomException as e:
-                logger.error(f"Error occurred: {e}")
-                access_token = Auth.auth_token_using_refresh_token()
-                raise CustomException
-            except TooManyRequestException as e:
-                logger.info(
-                    f"{e}. Retrying after {int(req.headers.get('Retry-After'))} seconds."
-                )
-                time.sleep(int(req.headers.get("Retry-After")))
-                raise TooManyRequestException from e
-            except requests.exceptions.HTTPError:
-                logger.error("Vectra API server is down. Retrying after 10 seconds.")
-                time.sleep(10)
-                raise requests.exceptions.HTTPError
-            except requests.exceptions.RequestException as req_exception:
-                logger.error(f"Retrying. An exception occurred: {req_exception}")
-                raise requests.exceptions.RequestException from req_exception
-            except Exception as e:
-                logger.error(f"An exception occurred: {e}")
-        return total_data
+                    return False
+        finally:
+            pages.close()
+            with timer.stage("checkpoint"):
+                Checkpoint.flush()
+            metrics.observe("pages_per_run", page_count, stream=stream)
+            timer.log()
+            logger.info(f"Fetch control of '{filename}': {controller.snapshot()}")
+            if dedup is not None:
+                logger.info(f"Deduplication of '{dedup.stream}': {dedup.stats()}")
+        return complete